@@ -19,6 +19,7 @@ uv run pyinstaller scripts/process_notebook.py \
     --clean \
     --paths . \
     --add-data "remarkable_mcp/openai_cleanup_prompt.txt:remarkable_mcp" \
+    --add-data "remarkable_mcp/create_notes.applescript:remarkable_mcp" \
     --hidden-import "google.cloud.vision" \
     --hidden-import "yaml" \
     --hidden-import "rmc" \
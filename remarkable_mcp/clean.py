@@ -1,82 +1,369 @@
+import functools
+import hashlib
 import json
 import os
-import urllib.error
-import urllib.request
+import random
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
 from pathlib import Path
+from typing import Dict, List, Optional
 
-# Load env variables if available
-try:
-    from dotenv import load_dotenv
+import requests
+from requests.adapters import HTTPAdapter
 
-    load_dotenv()
-except ImportError:
-    pass
 
-OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY", "").strip()
-OPENAI_REPAIR_MODEL = os.environ.get("OPENAI_REPAIR_MODEL", "gpt-4o-mini").strip()
-# Set to 'true' by default, can be disabled via env
-ENABLE_REPAIR = os.environ.get("ENABLE_REPAIR", "true").lower() in ("true", "1", "yes")
+@dataclass(frozen=True)
+class _Config:
+    """Cleanup settings parsed once from the environment."""
+
+    repair_model: str
+    # Set to True by default, can be disabled via env
+    enable_repair: bool
+    # Max number of pages sent together in one batched cleanup request
+    batch_size: int
+    # Submit cleanup through the asynchronous Batch API (cheaper, but may take hours).
+    # The sync waits for the batch, polling every batch_poll_seconds, for up to
+    # batch_timeout_seconds (default 24h) before keeping the raw text
+    enable_batch_api: bool
+    batch_poll_seconds: int
+    batch_timeout_seconds: int
+    # Client-side rate limits (0 = unlimited) and concurrency for per-page cleanup calls
+    rpm: int
+    tpm: int
+    concurrency: int
+    # Pages with fewer non-blank characters than this are stray OCR artifacts, not worth a call
+    min_chars: int
+    # Reuse cached cleaned text for pages already cleaned with the same prompt
+    # (only when the caller passes a cache_dir)
+    enable_cache: bool
+
+
+def _env_flag(name: str, default: str) -> bool:
+    return os.environ.get(name, default).lower() in ("true", "1", "yes")
+
+
+@functools.cache
+def _config() -> _Config:
+    # Load env variables if available
+    try:
+        from dotenv import load_dotenv
+
+        load_dotenv()
+    except ImportError:
+        pass
+
+    return _Config(
+        repair_model=os.environ.get("OPENAI_REPAIR_MODEL", "gpt-4o-mini").strip(),
+        enable_repair=_env_flag("ENABLE_REPAIR", "true"),
+        batch_size=int(os.environ.get("OPENAI_REPAIR_BATCH_SIZE", "8")),
+        enable_batch_api=_env_flag("ENABLE_BATCH_API", "false"),
+        batch_poll_seconds=int(os.environ.get("OPENAI_BATCH_POLL_SECONDS", "30")),
+        batch_timeout_seconds=int(
+            os.environ.get("OPENAI_BATCH_TIMEOUT_SECONDS", str(24 * 60 * 60))
+        ),
+        rpm=int(os.environ.get("OPENAI_RPM", "0")),
+        tpm=int(os.environ.get("OPENAI_TPM", "0")),
+        concurrency=int(os.environ.get("OPENAI_REPAIR_CONCURRENCY", "8")),
+        min_chars=int(os.environ.get("OPENAI_REPAIR_MIN_CHARS", "8")),
+        enable_cache=_env_flag("ENABLE_REPAIR_CACHE", "true"),
+    )
+
+
+def _needs_repair(text: str) -> bool:
+    return bool(text) and len(text.strip()) >= max(1, _config().min_chars)
+
+
+def _api_key() -> str:
+    """
+    The API key is not part of the cached config: process_notebook sets it from
+    config.yml after this module has been imported.
+    """
+    _config()  # make sure .env has been loaded
+    return os.environ.get("OPENAI_API_KEY", "").strip()
+
+
+OPENAI_API_BASE = "https://api.openai.com/v1"
+SYSTEM_PROMPT = (
+    "You are an expert editor for handwritten notes. Your goal is to restore the author's "
+    "original intent by fixing OCR misinterpretations while preserving their voice."
+)
 
 PROMPT_FILE = Path(__file__).parent / "openai_cleanup_prompt.txt"
 
 
+class _TokenBucket:
+    """Thread-safe token bucket refilled continuously at `per_minute` tokens per minute."""
+
+    def __init__(self, per_minute: int):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self, amount: float = 1.0) -> None:
+        if self.rate <= 0:
+            return
+        # A single request larger than the bucket would otherwise wait forever
+        amount = min(amount, self.capacity)
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return
+                wait = (amount - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+# Shared keep-alive session so repeated cleanup calls reuse the TLS connection.
+# The API key is still sent per request since config may be loaded after import.
+_SESSION = requests.Session()
+_SESSION.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=16))
+
+_warmed_up = False
+
+
+def warm_up_connection() -> None:
+    """
+    Open the pooled TLS connection to api.openai.com in the background so the
+    first cleanup call doesn't pay the handshake. Call it from the process that
+    will run the cleanup (it is not done on import). Safe to call more than once.
+    """
+    global _warmed_up
+    if _warmed_up or not _config().enable_repair or not _api_key():
+        return
+    _warmed_up = True
+
+    def _head():
+        try:
+            _SESSION.head(f"{OPENAI_API_BASE}/models", timeout=5)
+        except Exception:
+            pass
+
+    threading.Thread(target=_head, name="openai-warmup", daemon=True).start()
+
+
+_request_bucket = _TokenBucket(_config().rpm)
+_token_bucket = _TokenBucket(_config().tpm)
+# Number of processes running cleanup at once that split the limits above (see share_limits)
+_processes = 1
+
+
+def _share(limit: int) -> int:
+    """This process's share of a limit (0 = unlimited stays unlimited)."""
+    return max(1, limit // _processes) if limit > 0 else 0
+
+
+def share_limits(processes: int) -> None:
+    """
+    Split OPENAI_RPM, OPENAI_TPM and OPENAI_REPAIR_CONCURRENCY evenly across
+    `processes` processes cleaning up at the same time (e.g. as a Pool initializer),
+    so that together they stay within the configured limits instead of each
+    enforcing all of them.
+    """
+    global _processes, _request_bucket, _token_bucket
+    _processes = max(1, processes)
+    _request_bucket = _TokenBucket(_share(_config().rpm))
+    _token_bucket = _TokenBucket(_share(_config().tpm))
+
+
+def _concurrency() -> int:
+    return max(1, _share(_config().concurrency))
+
+
+@functools.lru_cache(maxsize=1)
 def _read_prompt_instructions() -> str:
     if PROMPT_FILE.exists():
         return PROMPT_FILE.read_text(encoding="utf-8").strip()
     return "Clean this OCR text."
 
 
-def _openai_chat(prompt: str) -> str:
+def _chat_payload(prompt: str, json_mode: bool = False) -> dict:
+    """Build the chat completion request body for a cleanup prompt."""
+    payload = {
+        "model": _config().repair_model,
+        "messages": [
+            {"role": "system", "content": SYSTEM_PROMPT},
+            {"role": "user", "content": prompt},
+        ],
+        "temperature": 0.3,
+    }
+    if json_mode:
+        payload["response_format"] = {"type": "json_object"}
+    return payload
+
+
+# Transient HTTP statuses worth retrying with backoff
+_RETRY_STATUS = frozenset({408, 409, 429, 500, 502, 503, 504})
+_MAX_ATTEMPTS = 5
+# Longest wait between retries, including one asked for by a Retry-After header
+_MAX_BACKOFF = 60.0
+
+
+def _retry_delay(attempt: int, resp=None) -> float:
+    """
+    Exponential backoff with jitter for the given (0-based) attempt.
+    A Retry-After header on the response takes precedence, up to _MAX_BACKOFF.
+    """
+    default = min(_MAX_BACKOFF, 2.0**attempt) + random.random()
+    if resp is None:
+        return default
+    try:
+        return min(_MAX_BACKOFF, max(0.0, float(resp.headers.get("Retry-After", default))))
+    except (TypeError, ValueError):
+        return default
+
+
+def _openai_chat(prompt: str, json_mode: bool = False) -> str:
     """
     Minimal OpenAI-compatible chat call via HTTP.
     Uses OPENAI_API_KEY and OPENAI_REPAIR_MODEL.
+    If json_mode is set, the model is asked to return a JSON object.
+    Transient errors (timeouts, 429, 5xx, dropped connections) are retried with
+    exponential backoff before giving up.
     """
     # Fetch key dynamically to support lazy config loading
-    api_key = os.environ.get("OPENAI_API_KEY", "").strip()
+    api_key = _api_key()
     
     if not api_key:
         print("Warning: OPENAI_API_KEY not set env var. Skipping text cleanup.")
         return ""
 
-    url = "https://api.openai.com/v1/chat/completions"
-    payload = {
-        "model": OPENAI_REPAIR_MODEL,
-        "messages": [
+    url = f"{OPENAI_API_BASE}/chat/completions"
+    data = json.dumps(_chat_payload(prompt, json_mode)).encode("utf-8")
+    headers = {"Authorization": f"Bearer {api_key}", "Content-Type": "application/json"}
+
+    # Rough token estimate (~4 chars per token) for the TPM limiter
+    estimated_tokens = len(data) / 4
+
+    for attempt in range(_MAX_ATTEMPTS):
+        last_attempt = attempt == _MAX_ATTEMPTS - 1
+        try:
+            _request_bucket.acquire()
+            _token_bucket.acquire(estimated_tokens)
+            resp = _SESSION.post(url, data=data, headers=headers, timeout=120)
+
+            if resp.status_code in _RETRY_STATUS and not last_attempt:
+                delay = _retry_delay(attempt, resp)
+                print(f"OpenAI API HTTP {resp.status_code}, retrying in {delay:.1f}s...")
+                time.sleep(delay)
+                continue
+
+            if resp.status_code != 200:
+                print(f"OpenAI API HTTP Error: {resp.status_code} {resp.reason}")
+                print(f"Details: {resp.text}")
+                return ""
+
+            return resp.json()["choices"][0]["message"]["content"]
+        except (requests.ConnectionError, requests.Timeout) as e:
+            if last_attempt:
+                print(f"OpenAI API Connection Error: {e}")
+                return ""
+            delay = _retry_delay(attempt)
+            print(f"OpenAI API Connection Error, retrying in {delay:.1f}s: {e}")
+            time.sleep(delay)
+        except Exception as e:
+            print(f"OpenAI Unexpected Error: {e}")
+            return ""
+    return ""
+
+
+def _openai_batch(prompts: Dict[str, str]) -> Dict[str, str]:
+    """
+    Run chat prompts through the OpenAI Batch API.
+    Uploads one JSONL request per prompt, polls the batch until it finishes and
+    returns a mapping of custom_id -> response content. Failed or missing
+    requests are left out of the result.
+    """
+    api_key = _api_key()
+    headers = {"Authorization": f"Bearer {api_key}"}
+
+    jsonl = "\n".join(
+        json.dumps(
             {
-                "role": "system",
-                "content": "You are an expert editor for handwritten notes. Your goal is to restore the author's original intent by fixing OCR misinterpretations while preserving their voice.",
+                "custom_id": custom_id,
+                "method": "POST",
+                "url": "/v1/chat/completions",
+                "body": _chat_payload(prompt),
             },
-            {"role": "user", "content": prompt},
-        ],
-        "temperature": 0.3,
-    }
-
-    data = json.dumps(payload).encode("utf-8")
-    req = urllib.request.Request(url, data=data, method="POST")
-    req.add_header("Authorization", f"Bearer {api_key}")
-    req.add_header("Content-Type", "application/json")
+            ensure_ascii=False,
+        )
+        for custom_id, prompt in prompts.items()
+    )
 
     try:
-        with urllib.request.urlopen(req, timeout=120) as resp:
-            body = resp.read().decode("utf-8")
-            j = json.loads(body)
-            # Handle potential API errors in response body if status was 200 (less likely with urllib)
-            return j["choices"][0]["message"]["content"]
-    except urllib.error.HTTPError as e:
-        print(f"OpenAI API HTTP Error: {e.code} {e.reason}")
-        # Try to read error body
+        resp = _SESSION.post(
+            f"{OPENAI_API_BASE}/files",
+            headers=headers,
+            data={"purpose": "batch"},
+            files={"file": ("cleanup.jsonl", jsonl.encode("utf-8"), "application/jsonl")},
+            timeout=120,
+        )
+        resp.raise_for_status()
+        input_file_id = resp.json()["id"]
+
+        resp = _SESSION.post(
+            f"{OPENAI_API_BASE}/batches",
+            headers=headers,
+            json={
+                "input_file_id": input_file_id,
+                "endpoint": "/v1/chat/completions",
+                "completion_window": "24h",
+            },
+            timeout=60,
+        )
+        resp.raise_for_status()
+        batch = resp.json()
+        print(f"Submitted OpenAI batch {batch['id']} with {len(prompts)} requests.")
+
+        deadline = time.monotonic() + _config().batch_timeout_seconds
+        while batch.get("status") not in ("completed", "failed", "expired", "cancelled"):
+            if time.monotonic() > deadline:
+                print(f"OpenAI batch {batch['id']} did not finish in time. Skipping text cleanup.")
+                return {}
+            time.sleep(_config().batch_poll_seconds)
+            resp = _SESSION.get(
+                f"{OPENAI_API_BASE}/batches/{batch['id']}", headers=headers, timeout=60
+            )
+            resp.raise_for_status()
+            batch = resp.json()
+
+        if batch["status"] != "completed" or not batch.get("output_file_id"):
+            print(f"OpenAI batch {batch['id']} ended with status: {batch['status']}")
+            return {}
+
+        resp = _SESSION.get(
+            f"{OPENAI_API_BASE}/files/{batch['output_file_id']}/content",
+            headers=headers,
+            timeout=120,
+        )
+        resp.raise_for_status()
+    except requests.RequestException as e:
+        print(f"OpenAI Batch API Error: {e}")
+        return {}
+    except (KeyError, ValueError) as e:
+        print(f"OpenAI Batch API unexpected response: {e}")
+        return {}
+
+    results = {}
+    for line in resp.text.splitlines():
+        if not line.strip():
+            continue
         try:
-            err_body = e.read().decode("utf-8")
-            print(f"Details: {err_body}")
-        except Exception:
-            pass
-        return ""
-    except urllib.error.URLError as e:
-        print(f"OpenAI API Connection Error: {e.reason}")
-        return ""
-    except Exception as e:
-        print(f"OpenAI Unexpected Error: {e}")
-        return ""
+            entry = json.loads(line)
+            response = entry.get("response") or {}
+            if response.get("status_code") != 200:
+                continue
+            results[entry["custom_id"]] = response["body"]["choices"][0]["message"]["content"]
+        except (ValueError, KeyError, IndexError, TypeError):
+            continue
+    return results
 
 
 def repair_text_with_openai(text: str) -> str:
@@ -84,22 +371,159 @@ def repair_text_with_openai(text: str) -> str:
     Clean up OCR text using OpenAI.
     Returns the cleaned text, or the original text if repair fails/disabled.
     """
-    if not ENABLE_REPAIR:
+    if not _config().enable_repair:
         return text
 
-    # Fetch key dynamically
-    api_key = os.environ.get("OPENAI_API_KEY", "").strip()
-    if not api_key:
+    if not _api_key():
         return text
 
-    if not text or not text.strip():
+    if not _needs_repair(text):
         return text
 
-    instructions = _read_prompt_instructions()
-    prompt = f"{instructions}\n\nTEXT:\n{text}"
-
-    out = _openai_chat(prompt)
+    out = _openai_chat(_repair_prompt(text))
     if not out:
         return text  # Fallback to original
 
     return out.strip()
+
+
+def _repair_prompt(text: str) -> str:
+    return f"{_read_prompt_instructions()}\n\nTEXT:\n{text}"
+
+
+def _repair_batch(texts: List[str]) -> Optional[List[str]]:
+    """
+    Clean several texts in one chat call.
+    Returns the cleaned texts in input order, or None if the response can't be used.
+    """
+    instructions = _read_prompt_instructions()
+    prompt = (
+        f"{instructions}\n\n"
+        'Each item below is a separate page. Return a JSON object of the form {"items": [...]} '
+        "holding the cleaned text of every item, in the same order.\n\n"
+        f"ITEMS:\n{json.dumps({'items': texts}, ensure_ascii=False)}"
+    )
+
+    out = _openai_chat(prompt, json_mode=True)
+    if not out:
+        return None
+
+    try:
+        items = json.loads(out)["items"]
+    except (ValueError, KeyError, TypeError):
+        return None
+
+    if not isinstance(items, list) or len(items) != len(texts):
+        return None
+    if not all(isinstance(item, str) for item in items):
+        return None
+
+    return [item.strip() for item in items]
+
+
+def _repair_cache_path(text: str, cache_dir: Path) -> Path:
+    key = hashlib.sha256(
+        "\0".join(
+            (_config().repair_model, SYSTEM_PROMPT, _read_prompt_instructions(), text)
+        ).encode("utf-8")
+    ).hexdigest()
+    return cache_dir / key[:2] / f"{key}.txt"
+
+
+def _read_repair_cache(text: str, cache_dir: Path) -> Optional[str]:
+    try:
+        return _repair_cache_path(text, cache_dir).read_text(encoding="utf-8")
+    except OSError:
+        return None
+
+
+def _write_repair_cache(text: str, cleaned: str, cache_dir: Path) -> None:
+    path = _repair_cache_path(text, cache_dir)
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Temp file + rename: notebooks may be cleaned in parallel processes
+        fd, tmp = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(cleaned)
+        os.replace(tmp, path)
+    except OSError as e:
+        print(f"Could not cache cleaned text: {e}")
+
+
+def _cache_repairs(
+    texts: List[str], results: List[str], indices: List[int], cache_dir: Optional[Path]
+) -> None:
+    """Cache the cleaned pages at indices; unchanged ones may be failed calls, so skip them."""
+    if cache_dir is None or not _config().enable_cache:
+        return
+    for i in indices:
+        if results[i] != texts[i]:
+            _write_repair_cache(texts[i], results[i], cache_dir)
+
+
+def repair_texts_with_openai(texts: List[str], cache_dir: Optional[Path] = None) -> List[str]:
+    """
+    Clean up a list of OCR texts (e.g. the pages of a notebook) using OpenAI.
+    Pages are sent in batches of OPENAI_REPAIR_BATCH_SIZE per request, with up to
+    OPENAI_REPAIR_CONCURRENCY batches in flight (see share_limits); if a batched
+    response can't be parsed, its pages are repaired one by one instead, within
+    the same in-flight limit. Pages cleaned before (same
+    text, model and prompt) are taken from cache_dir without a request; with no
+    cache_dir, nothing is cached.
+    Returns the cleaned texts in input order, with originals kept on failure.
+    """
+    results = list(texts)
+    if not _config().enable_repair:
+        return results
+
+    if not _api_key():
+        return results
+
+    # Blank and near-blank pages are passed through untouched
+    pending = [i for i, t in enumerate(texts) if _needs_repair(t)]
+
+    if cache_dir is not None and _config().enable_cache:
+        uncached = []
+        for i in pending:
+            cached = _read_repair_cache(texts[i], cache_dir)
+            if cached is None:
+                uncached.append(i)
+            else:
+                results[i] = cached
+        pending = uncached
+
+    if not pending:
+        return results
+
+    if _config().enable_batch_api:
+        prompts = {str(i): _repair_prompt(texts[i]) for i in pending}
+        for custom_id, out in _openai_batch(prompts).items():
+            if out and out.strip():
+                results[int(custom_id)] = out.strip()
+        _cache_repairs(texts, results, pending, cache_dir)
+        return results
+
+    batch_size = max(1, _config().batch_size)
+    chunks = [pending[start : start + batch_size] for start in range(0, len(pending), batch_size)]
+
+    def repair_chunk(indices: List[int]) -> List[str]:
+        if len(indices) == 1:
+            return [repair_text_with_openai(texts[indices[0]])]
+
+        cleaned = _repair_batch([texts[i] for i in indices])
+        if cleaned is None:
+            print("Batched cleanup response could not be parsed. Falling back to per-page calls.")
+            # Sequentially: this chunk already holds one of the `workers` slots
+            cleaned = [repair_text_with_openai(texts[i]) for i in indices]
+        return cleaned
+
+    # Batches are independent requests, so send them concurrently (bounded by the limiters)
+    workers = min(_concurrency(), len(chunks))
+    with ThreadPoolExecutor(max_workers=workers) as ex:
+        for indices, cleaned in zip(chunks, ex.map(repair_chunk, chunks)):
+            for i, text in zip(indices, cleaned):
+                # Keep the original if the model returned nothing for this page
+                results[i] = text or texts[i]
+
+    _cache_repairs(texts, results, pending, cache_dir)
+    return results
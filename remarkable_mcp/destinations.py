@@ -5,20 +5,137 @@ Abstracts the target (Apple Notes, Obsidian, etc.) from the processing logic.
 
 import abc
 import html
-import json
 import logging
+import os
+import re
 import shutil
 import subprocess
 import time
 import datetime
+import functools
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
 from pathlib import Path
-from typing import List, Optional
+from typing import TYPE_CHECKING, List, Optional
 
-from PIL import Image
+if TYPE_CHECKING:
+    from PIL import Image
 
 # Configure module logger
 logger = logging.getLogger(__name__)
 
+# zlib level for the opaque PNGs handed to Apple Notes. Notes re-encodes them
+# anyway, so favour encode speed over file size (PIL's default is 6).
+PNG_COMPRESS_LEVEL = int(os.environ.get("REMARKABLE_PNG_LEVEL", "1"))
+
+
+# Characters replaced with "-" in Obsidian file names
+_SANITIZE_TABLE = str.maketrans({"/": "-", ":": "-", "\\": "-"})
+
+# YAML frontmatter of every Obsidian note, followed by a blank line
+_OBSIDIAN_FRONTMATTER = (
+    "---\n"
+    "created: {created}\n"
+    "source: Remarkable/{source}\n"
+    "tags:\n"
+    "  - remarkable\n"
+    "  - handwritten\n"
+    "---\n"
+    "\n"
+)
+
+# Same line boundaries as str.splitlines()
+_LINE_BREAK_RE = re.compile(r"\r\n|[\n\r\x0b\x0c\x1c\x1d\x1e\x85\u2028\u2029]")
+_TRAILING_LINE_BREAK_RE = re.compile(r"(?:\r\n|[\n\r\x0b\x0c\x1c\x1d\x1e\x85\u2028\u2029])\Z")
+
+
+# PIL and NumPy are imported on first use: runs with nothing to publish never load them
+@functools.cache
+def _numpy():
+    """NumPy if installed (it speeds up alpha flattening), else None."""
+    try:
+        import numpy
+    except ImportError:
+        return None
+    return numpy
+
+
+def flatten_on_white(rgba: "Image.Image") -> "Image.Image":
+    """Composite an RGBA image onto a white background and return it as RGB."""
+    from PIL import Image
+
+    np = _numpy()
+    if np is None:
+        bg = Image.new("RGB", rgba.size, (255, 255, 255))
+        bg.paste(rgba, mask=rgba.split()[3])
+        return bg
+
+    # out = rgb * a + 255 * (1 - a), in integer math over the whole array at once
+    arr = np.asarray(rgba, dtype=np.uint16)
+    alpha = arr[..., 3:4]
+    rgb = (arr[..., :3] * alpha + 255 * (255 - alpha) + 127) // 255
+    return Image.fromarray(rgb.astype(np.uint8), "RGB")
+
+
+def _existing_images(image_paths: List[Path]) -> List[Path]:
+    """
+    Filter image_paths down to files that exist, keeping their order.
+    Lists each parent directory once instead of stat-ing every page.
+    """
+    names_by_dir = {}
+    for parent in {p.parent for p in image_paths}:
+        try:
+            with os.scandir(parent) as it:
+                names_by_dir[parent] = {entry.name for entry in it if entry.is_file()}
+        except OSError:
+            names_by_dir[parent] = set()
+    return [p for p in image_paths if p.name in names_by_dir[p.parent]]
+
+
+# Static AppleScript that creates the notes; its data is passed through a temp file
+NOTES_SCRIPT_SOURCE = Path(__file__).parent / "create_notes.applescript"
+# Separators used in that data file (ASCII record / unit separators)
+_RECORD_SEP = "\x1e"
+_FIELD_SEP = "\x1f"
+_SEPARATORS_TABLE = str.maketrans({_RECORD_SEP: None, _FIELD_SEP: None})
+
+
+@functools.cache
+def _notes_script() -> Path:
+    """
+    Path of the note-creation script, compiled to .scpt once and cached in the
+    temp directory so osascript doesn't re-parse the source on every run.
+    Falls back to the plain source file if osacompile is unavailable.
+    """
+    compiled = Path(tempfile.gettempdir()) / "living-ink" / "create_notes.scpt"
+    try:
+        source_mtime = NOTES_SCRIPT_SOURCE.stat().st_mtime
+        if compiled.exists() and compiled.stat().st_mtime >= source_mtime:
+            return compiled
+        compiled.parent.mkdir(parents=True, exist_ok=True)
+        result = subprocess.run(
+            ["osacompile", "-o", str(compiled), str(NOTES_SCRIPT_SOURCE)],
+            capture_output=True,
+            text=True,
+        )
+        if result.returncode == 0:
+            return compiled
+        logger.warning(f"osacompile failed, running the script source instead: {result.stderr}")
+    except OSError as e:
+        logger.warning(f"Could not compile {NOTES_SCRIPT_SOURCE.name}: {e}")
+    return NOTES_SCRIPT_SOURCE
+
+
+@dataclass
+class PublishJob:
+    """A notebook ready to be published, as passed to Destination.publish_batch."""
+
+    notebook_name: str
+    text_content: str
+    image_paths: List[Path]
+    sub_folder: Optional[str] = None
+
 
 class Destination(abc.ABC):
     """Abstract base class for publication destinations."""
@@ -45,6 +162,26 @@ class Destination(abc.ABC):
         """
         pass
 
+    def publish_batch(self, jobs: List[PublishJob]) -> List[bool]:
+        """
+        Publish several notebooks in one go.
+
+        The default publishes each job separately; destinations with a high
+        per-call cost (e.g. AppleScript) override this to share it.
+
+        Returns:
+            One success flag per job, in order.
+        """
+        return [
+            self.publish(
+                notebook_name=job.notebook_name,
+                text_content=job.text_content,
+                image_paths=job.image_paths,
+                sub_folder=job.sub_folder,
+            )
+            for job in jobs
+        ]
+
 
 class AppleNotesDestination(Destination):
     """Publishes notes to Apple Notes application via AppleScript."""
@@ -54,14 +191,13 @@ class AppleNotesDestination(Destination):
 
     def _convert_to_html(self, text: str) -> str:
         """Convert plain text to the HTML format expected by Apple Notes."""
-        text = text.lstrip()
-        html_lines = []
-        for line in text.splitlines():
-            if not line:
-                html_lines.append("<div><br></div>")
-            else:
-                html_lines.append(f"<div>{html.escape(line)}</div>")
-        return "".join(html_lines)
+        # Escape once, then turn every line break into a div boundary in one regex pass
+        text = _TRAILING_LINE_BREAK_RE.sub("", html.escape(text.lstrip()), count=1)
+        if not text:
+            return ""
+        body = "<div>" + _LINE_BREAK_RE.sub("</div><div>", text) + "</div>"
+        # Escaped text can't contain "<", so empty divs only come from blank lines
+        return body.replace("<div></div>", "<div><br></div>")
 
     def _create_opaque_image(self, img_path: Path) -> Path:
         """Create a version of the image with a white background (Apple Notes handles alpha poorly)."""
@@ -69,22 +205,48 @@ class AppleNotesDestination(Destination):
         if opaque_path.exists():
             return opaque_path
 
+        from PIL import Image
+
         try:
+            # Image.open only reads the header, so this check doesn't decode any pixels
             pil_img = Image.open(img_path)
-            bg = Image.new("RGB", pil_img.size, (255, 255, 255))
+            if pil_img.mode in ("RGB", "L") and "transparency" not in pil_img.info:
+                pil_img.close()
+                return img_path
+
             if pil_img.mode in ("RGBA", "LA") or (
                 pil_img.mode == "P" and "transparency" in pil_img.info
             ):
-                pil_img = pil_img.convert("RGBA")
-                bg.paste(pil_img, mask=pil_img.split()[3])
+                bg = flatten_on_white(pil_img.convert("RGBA"))
             else:
+                bg = Image.new("RGB", pil_img.size, (255, 255, 255))
                 bg.paste(pil_img)
-            bg.save(opaque_path, "PNG")
+            bg.save(opaque_path, "PNG", compress_level=PNG_COMPRESS_LEVEL, optimize=False)
             return opaque_path
         except Exception as e:
             logger.warning(f"Failed to create opaque PNG for {img_path.name}: {e}. Using original.")
             return img_path
 
+    def _note_record(self, job: PublishJob) -> str:
+        """One record of the create_notes.applescript data file."""
+        # 1. Prepare Content
+        text_html = self._convert_to_html(job.text_content)
+        final_body = "<div><br></div>" + text_html
+
+        # 2. Prepare Attachments
+        # Flattening is CPU-bound PNG decode/encode; PIL releases the GIL, so threads scale
+        existing = _existing_images(job.image_paths)
+        final_paths = []
+        if existing:
+            workers = min(len(existing), os.cpu_count() or 1)
+            with ThreadPoolExecutor(max_workers=workers) as ex:
+                final_paths = list(ex.map(self._create_opaque_image, existing))
+
+        fields = [job.notebook_name, job.sub_folder or "", final_body]
+        fields.extend(str(final_path.resolve()) for final_path in final_paths)
+        # Separator characters would split the record, so they can't appear in a field
+        return _FIELD_SEP.join(field.translate(_SEPARATORS_TABLE) for field in fields)
+
     def publish(
         self,
         notebook_name: str,
@@ -92,97 +254,79 @@ class AppleNotesDestination(Destination):
         image_paths: List[Path],
         sub_folder: Optional[str] = None,
     ) -> bool:
+        job = PublishJob(notebook_name, text_content, image_paths, sub_folder)
+        return self.publish_batch([job])[0]
+
+    def publish_batch(self, jobs: List[PublishJob]) -> List[bool]:
+        """Create all notes with a single osascript run, retrying only the ones that failed."""
         retries = 3
+        results = [False] * len(jobs)
+        if not jobs:
+            return results
 
-        # 1. Prepare Content
-        text_html = self._convert_to_html(text_content)
-        final_body = "<div><br></div>" + text_html
+        try:
+            records = [self._note_record(job) for job in jobs]
+        except Exception as e:
+            logger.error(f"Failed preparing Apple Notes: {e}")
+            return results
 
-        # 2. Prepare Attachments
-        attachment_cmds = ""
-        for img_p in image_paths:
-            if img_p.exists():
-                final_path = self._create_opaque_image(img_p)
-                # Safe quoting for AppleScript
-                safe_path = json.dumps(str(final_path.resolve()), ensure_ascii=False)
-                attachment_cmds += f"make new attachment at end of attachments of newNote with data (POSIX file {safe_path})\n    "
+        pending = list(range(len(jobs)))
+        data_path = None
 
         # 3. Execute AppleScript
         try:
-            for attempt in range(1, retries + 1):
-                safe_folder = json.dumps(self.folder_name, ensure_ascii=False)
-                safe_name = json.dumps(notebook_name, ensure_ascii=False)
-                safe_body = json.dumps(final_body, ensure_ascii=False)
-
-                if sub_folder:
-                    safe_sub_folder = json.dumps(sub_folder, ensure_ascii=False)
-                    has_sub = "true"
-                else:
-                    safe_sub_folder = '""'
-                    has_sub = "false"
-
-                applescript = f"""
-tell application "Notes"
-    set rootFolderName to {safe_folder}
-    
-    -- Check if root folder exists, if not create it
-    if not (exists folder rootFolderName) then
-        make new folder with properties {{name:rootFolderName}}
-    end if
-    set rootFolder to folder rootFolderName
-    
-    -- Determine target folder (Root or Sub)
-    set targetFolder to rootFolder
-    
-    if {has_sub} then
-        set subFolderName to {safe_sub_folder}
-        -- Check if subFolder exists INSIDE rootFolder
-        if not (exists folder subFolderName of rootFolder) then
-            make new folder at rootFolder with properties {{name:subFolderName}}
-        end if
-        set targetFolder to folder subFolderName of rootFolder
-    end if
-
-    -- Check if note exists in that folder and delete it to avoid duplication
-    set noteName to {safe_name}
-    try
-        delete (every note in targetFolder whose name is noteName)
-    end try
-    
-    -- Create the new note with HTML body in the specific folder
-    set newNote to make new note at targetFolder with properties {{name:noteName, body:{safe_body}}}
-    
-    -- Attach images
-    {attachment_cmds}
-end tell
-"""
-                # logger.debug(f'--- Attachment commands for {notebook_name}:')
-                # logger.debug(attachment_cmds.strip())
+            script_path = _notes_script()
+            with tempfile.NamedTemporaryFile("wb", suffix=".txt", delete=False) as f:
+                data_path = Path(f.name)
 
+            for attempt in range(1, retries + 1):
+                # Note data goes through a file: large batches would hit ARG_MAX as arguments.
+                # Records are streamed in, never joined into one batch-sized string.
+                with open(data_path, "w", encoding="utf-8", newline="") as f:
+                    for n, i in enumerate(pending):
+                        if n:
+                            f.write(_RECORD_SEP)
+                        f.write(records[i])
                 result = subprocess.run(
-                    ["osascript", "-e", applescript],
+                    ["osascript", str(script_path), str(data_path), self.folder_name],
                     check=False,
                     capture_output=True,
                     text=True,
-                    timeout=10,
+                    timeout=10 * len(pending),
                 )
 
                 if result.returncode != 0:
                     logger.warning(
                         f"AppleScript error (attempt {attempt}/{retries}, code {result.returncode}): {result.stderr}"
                     )
-                    if attempt < retries:
-                        time.sleep(2)
-                        continue
-                    else:
-                        return False
-
-                logger.info(f"Apple Note created for {notebook_name}")
-                return True
+                    failed = pending
+                else:
+                    flags = result.stdout.strip().split(",")
+                    failed = []
+                    for i, flag in zip(pending, flags + ["0"] * (len(pending) - len(flags))):
+                        if flag == "1":
+                            results[i] = True
+                            logger.info(f"Apple Note created for {jobs[i].notebook_name}")
+                        else:
+                            failed.append(i)
+                    if failed:
+                        logger.warning(
+                            f"AppleScript failed for {len(failed)} note(s) (attempt {attempt}/{retries}): {result.stderr}"
+                        )
+
+                if not failed:
+                    break
+                pending = failed
+                if attempt < retries:
+                    time.sleep(2)
 
         except Exception as e:
             logger.error(f"Failed creating Apple Note: {e}")
-            return False
+        finally:
+            if data_path is not None:
+                data_path.unlink(missing_ok=True)
+
+        return results
 
 
 class ObsidianDestination(Destination):
@@ -197,7 +341,7 @@ class ObsidianDestination(Destination):
     def _sanitize_filename(self, name: str) -> str:
         """Sanitize filename for filesystem."""
         # Simple sanitization - replace / and : with -
-        return name.replace("/", "-").replace(":", "-").replace("\\", "-")
+        return name.translate(_SANITIZE_TABLE)
 
     def publish(
         self,
@@ -230,61 +374,49 @@ class ObsidianDestination(Destination):
             attach_dir.mkdir(parents=True, exist_ok=True)
 
             image_refs = []
-
-            for img_p in image_paths:
-                if img_p.exists():
-                    # Create a unique filename for the attachment to avoid collisions
-                    # Format: {NotebookName}_{PageNum}.png or similar.
-                    # Assuming img_p.name is unique enough or we prepend notebook name
-                    clean_nb_name = self._sanitize_filename(notebook_name)
-                    new_filename = f"{clean_nb_name}_{img_p.name}"
-                    dest_path = attach_dir / new_filename
-
-                    shutil.copy2(img_p, dest_path)
-
-                    # Markdown link logic
-                    # If attachments are in a subfolder, we need the relative path
-                    # Obsidian handles [[filename]] automatically if it's unique, but standard markdown needs path
-                    # Let's use standard markdown for max compatibility: ![Alt](path)
-                    # Path should be relative to the note file
-
-                    # Obsidian WikiLink style (often preferred by Obsidian users)
-                    image_refs.append(f"![[{new_filename}]]")
+            copies = []
+            clean_nb_name = self._sanitize_filename(notebook_name)
+
+            for img_p in _existing_images(image_paths):
+                # Create a unique filename for the attachment to avoid collisions
+                # Format: {NotebookName}_{PageNum}.png or similar.
+                # Assuming img_p.name is unique enough or we prepend notebook name
+                new_filename = f"{clean_nb_name}_{img_p.name}"
+                copies.append((img_p, attach_dir / new_filename))
+
+                # Markdown link logic
+                # If attachments are in a subfolder, we need the relative path
+                # Obsidian handles [[filename]] automatically if it's unique, but standard markdown needs path
+                # Let's use standard markdown for max compatibility: ![Alt](path)
+                # Path should be relative to the note file
+
+                # Obsidian WikiLink style (often preferred by Obsidian users)
+                image_refs.append(f"![[{new_filename}]]")
+
+            # Copies are I/O-bound, so overlap them on a small thread pool
+            if copies:
+                with ThreadPoolExecutor(max_workers=min(len(copies), 8)) as ex:
+                    list(ex.map(lambda pair: shutil.copyfile(*pair), copies))
 
             # 3. Create Markdown Content
-            md_lines = []
-            
-            # --- YAML Frontmatter ---
             source_path = notebook_name.replace(" / ", "/")
             today_str = datetime.date.today().isoformat()
-            
-            md_lines.append("---")
-            md_lines.append(f"created: {today_str}")
-            md_lines.append(f"source: Remarkable/{source_path}")
-            md_lines.append("tags:")
-            md_lines.append("  - remarkable")
-            md_lines.append("  - handwritten")
-            md_lines.append("---")
-            md_lines.append("")
-
-            # --- Content ---
-            md_lines.append(text_content)
-            md_lines.append("")
-            
-            if image_refs:
-                md_lines.append("## Original Pages")
-                for ref in image_refs:
-                    md_lines.append(ref)
-                    md_lines.append("")
 
-            final_md = "\n".join(md_lines)
+            parts = [
+                _OBSIDIAN_FRONTMATTER.format(created=today_str, source=source_path),
+                text_content,
+                "\n",
+            ]
+            if image_refs:
+                parts.append("\n## Original Pages\n")
+                parts.append("\n\n".join(image_refs))
+                parts.append("\n")
 
-            # 4. Write File
+            # 4. Write File (parts are streamed, so the note text is never copied)
             safe_name = self._sanitize_filename(notebook_name)
             note_path = target_dir / f"{safe_name}.md"
-
-            with open(note_path, "w", encoding="utf-8") as f:
-                f.write(final_md)
+            with open(note_path, "w", encoding="utf-8", newline="") as f:
+                f.writelines(parts)
 
             logger.info(f"Obsidian note created at: {note_path}")
             return True
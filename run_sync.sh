@@ -100,10 +100,11 @@ cmd=(uv run python scripts/process_notebook.py
   --state-file "${STATE_FILE}"
 )
 
-# Note: --force and --dry-run are currently ignored by the new pipeline script
-# if [[ "${FORCE}" == "1" ]]; then
-#   cmd+=(--force)
-# fi
+# --force discards cached renders, preprocessed pages, OCR and cleaned text
+if [[ "${FORCE}" == "1" ]]; then
+  cmd+=(--force)
+fi
+# Note: --dry-run is currently ignored by the new pipeline script
 # if [[ "${DRY_RUN}" == "1" ]]; then
 #   cmd+=(--dry-run)
 # fi
@@ -1,30 +1,71 @@
 #!/usr/bin/env python3
-"""Process one notebook: preprocess PNGs, run Google Vision OCR, aggregate text, build PDF, create Apple Note."""
+"""Process one notebook: preprocess PNGs, run Google Vision OCR, aggregate text, build PDF, create Apple Note.
+
+Image budget for OCR: pages sent to Google Vision are scaled so the long edge is at most
+VISION_MAX_EDGE pixels (never upscaled more than 1.5x) and encoded as JPEG at
+VISION_JPEG_QUALITY. Larger or lossless images cost upload time without improving OCR.
+"""
 
 import argparse
+import asyncio
+import atexit
+import bisect
 import datetime
+import functools
+import hashlib
 import importlib.util
+import itertools
 import json
 import logging
+import multiprocessing
 import os
+import re
+import shutil
 import sys
-import time
+import tempfile
+import traceback
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 from pathlib import Path
-from typing import List
+from typing import Any, List, NamedTuple, Optional
+
+# PIL, PyYAML and pyvips are imported where they're used, which keeps startup light
+# for runs that exit early with nothing to do and for each Pool worker
 
-import yaml
-from PIL import Image, ImageFilter, ImageOps
+# orjson is optional; it parses and writes the processed logs much faster than json
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# blake3 is optional; it hashes pages for the OCR cache faster than hashlib
+try:
+    import blake3
+except ImportError:
+    blake3 = None
 
 # Ensure remarkable_mcp is importable
 sys.path.append(str(Path(__file__).parent.parent))
 
-from remarkable_mcp.destinations import AppleNotesDestination, ObsidianDestination, Destination
+from remarkable_mcp.destinations import (
+    AppleNotesDestination,
+    Destination,
+    ObsidianDestination,
+    PublishJob,
+)
 
 try:
-    from remarkable_mcp.clean import repair_text_with_openai
+    from remarkable_mcp.clean import (
+        repair_texts_with_openai,
+        share_limits,
+        warm_up_connection,
+    )
 except ImportError:
     # If standard import fails, we rely on the sys.path hack above
-    from remarkable_mcp.clean import repair_text_with_openai
+    from remarkable_mcp.clean import (
+        repair_texts_with_openai,
+        share_limits,
+        warm_up_connection,
+    )
 
 
 # --- LOGGING SUPPRESSION ---
@@ -51,6 +92,12 @@ WHITE_DIR = ROOT / "remarkable_pngs_white"
 VISION_DIR = ROOT / "remarkable_pngs_for_vision"
 OCR_DIR = ROOT / "output"  # Changed from remarkable_ocr to output
 PDF_DIR = ROOT / "remarkable_pdfs"
+# OCR text keyed by a hash of the preprocessed page, so unchanged pages skip Vision
+# when a notebook is re-rendered for a new version (or recur in another notebook)
+OCR_CACHE_DIR = ROOT / "ocr_cache"
+# OpenAI-cleaned page texts, keyed by a hash of model, prompt and raw OCR text (the
+# only cache location; clean.py caches nothing unless given a cache_dir)
+REPAIR_CACHE_DIR = ROOT / os.environ.get("OPENAI_REPAIR_CACHE_DIR", "cleanup_cache")
 PROCESSED_LOG = ROOT / "processed_notebooks.json"
 LOGS_DIR = ROOT / "logs"
 LOGS_DIR.mkdir(exist_ok=True)
@@ -59,20 +106,67 @@ LOG_PATH = LOGS_DIR / "pipeline.log"
 VISION_DIR.mkdir(exist_ok=True)
 OCR_DIR.mkdir(exist_ok=True)
 PDF_DIR.mkdir(exist_ok=True)
+OCR_CACHE_DIR.mkdir(exist_ok=True)
+
+# Number of worker processes preprocessing page images in parallel
+PREPROC_CONCURRENCY = int(os.environ.get("PREPROC_CONCURRENCY", os.cpu_count() or 1))
+# Number of notebooks rendered/OCR'd/cleaned in parallel worker processes
+NOTEBOOK_CONCURRENCY = int(os.environ.get("NOTEBOOK_CONCURRENCY", os.cpu_count() or 1))
+
+# Image budget for OCR pages (see module docstring)
+VISION_MAX_EDGE = int(os.environ.get("VISION_MAX_EDGE", "2048"))
+VISION_JPEG_QUALITY = int(os.environ.get("VISION_JPEG_QUALITY", "85"))
+# Autocontrast + sharpen pages before OCR; when off, JPEG pages already within the
+# budget are passed to Vision byte-for-byte
+PREPROC_ENHANCE = os.environ.get("PREPROC_ENHANCE", "true").lower() in ("true", "1", "yes")
+
+# Google Vision accepts up to 16 images per batch_annotate_images request; keep the
+# request body well under the API's size limit as well
+VISION_BATCH_SIZE = 16
+VISION_BATCH_MAX_BYTES = 8 * 1024 * 1024
+# Number of Vision batch requests in flight at once, shared by the notebooks OCR'd
+# in parallel (see init_notebook_worker)
+VISION_CONCURRENCY = int(os.environ.get("VISION_CONCURRENCY", "8"))
+# gRPC options for the Vision channel each OCR run opens (_vision_async_client): the
+# client library's unlimited message sizes, plus keepalive pings so a connection that
+# died between two batches of the run is noticed quickly
+VISION_GRPC_OPTIONS = [
+    ("grpc.max_send_message_length", -1),
+    ("grpc.max_receive_message_length", -1),
+    ("grpc.keepalive_time_ms", 30000),
+    # Give up on a ping after 10s instead of gRPC's default 20s, so a batch on a dead
+    # connection fails (and is retried by vision_ocr_batch) sooner
+    ("grpc.keepalive_timeout_ms", 10000),
+]
+
+# Log full tracebacks for failures (off by default: one line per failure)
+DEBUG = os.environ.get("LIVING_INK_DEBUG", "").lower() in ("true", "1", "yes")
 
 
 # --- NEW CONFIGURATION LOADING (YAML) ---
+# Configuration is loaded by main() (load_config), not on import: worker processes
+# started with "spawn" (the macOS default) re-import this module, and they inherit
+# the environment variables set here from the parent anyway.
 
 # Try loading from config/config.yml (standard location) or root config.yml
 YAML_CONFIG_PATH = ROOT / "config" / "config.yml"
 if not YAML_CONFIG_PATH.exists():
     YAML_CONFIG_PATH = ROOT / "config.yml"
 
-if YAML_CONFIG_PATH.exists():
-    try:
-        with open(YAML_CONFIG_PATH, "r") as f:
+
+def load_yaml_config() -> dict:
+    """
+    Read config.yml into the environment variables the pipeline uses (writing embedded
+    Google credentials to config/google_creds.json) and return its contents.
+    """
+    yaml_config = {}
+    if YAML_CONFIG_PATH.exists():
+        try:
+            import yaml
+
             try:
-                yaml_config = yaml.safe_load(f) or {}
+                with open(YAML_CONFIG_PATH, "r") as f:
+                    yaml_config = yaml.safe_load(f) or {}
             except yaml.YAMLError as ye:
                 print("\n❌ CONFIGURATION ERROR: Could not parse config.yml")
                 print("Please check your indentation. YAML is very sensitive to spaces.")
@@ -145,23 +239,17 @@ if YAML_CONFIG_PATH.exists():
                         yaml_config["apple_notes"]["folder_name"]
                     )
 
-    except Exception as e:
-        print(f"Critical error loading config.yml: {e}")
+        except Exception as e:
+            print(f"Critical error loading config.yml: {e}")
 
-# Legacy Fallback
-try:
-    from dotenv import load_dotenv
+    return yaml_config
 
-    load_dotenv()
-except ImportError:
-    pass
 
-# Load config
+# Legacy config.py, read after config.yml and .env
 CONFIG_PATH = ROOT / "config.py"
-max_notebooks_per_run = int(os.environ.get("SYNC_MAX_NOTEBOOKS", 1))
-
-if CONFIG_PATH.exists():
-    spec = importlib.util.spec_from_file_location("config", str(CONFIG_PATH))
+# Set by load_config()
+max_notebooks_per_run = 1
+ACTIVE_DESTINATIONS: List[Destination] = []
 
 # --- DESTINATION SETUP ---
 
@@ -216,16 +304,31 @@ def get_destinations_from_config(config_dict) -> List[Destination]:
     return dests
 
 
-# Construct global destinations list
-ACTIVE_DESTINATIONS = get_destinations_from_config(yaml_config if "yaml_config" in locals() else {})
+def load_config():
+    """Load config.yml, .env and the legacy config.py, and set up ACTIVE_DESTINATIONS."""
+    global ACTIVE_DESTINATIONS, max_notebooks_per_run
+    yaml_config = load_yaml_config()
+
+    # Legacy Fallback
+    try:
+        from dotenv import load_dotenv
+
+        load_dotenv()
+    except ImportError:
+        pass
 
-if CONFIG_PATH.exists():
-    spec = importlib.util.spec_from_file_location("config", str(CONFIG_PATH))
-    config = importlib.util.module_from_spec(spec)
-    spec.loader.exec_module(config)
-    # Prefer legacy config.py if it exists, otherwise fall back to env/default
-    if hasattr(config, "max_notebooks_per_run"):
-        max_notebooks_per_run = getattr(config, "max_notebooks_per_run")
+    max_notebooks_per_run = int(os.environ.get("SYNC_MAX_NOTEBOOKS", 1))
+
+    # Construct global destinations list
+    ACTIVE_DESTINATIONS = get_destinations_from_config(yaml_config)
+
+    if CONFIG_PATH.exists():
+        spec = importlib.util.spec_from_file_location("config", str(CONFIG_PATH))
+        config = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(config)
+        # Prefer legacy config.py if it exists, otherwise fall back to env/default
+        if hasattr(config, "max_notebooks_per_run"):
+            max_notebooks_per_run = getattr(config, "max_notebooks_per_run")
 
 
 def get_state_file_path(dest_name: str) -> Path:
@@ -233,37 +336,280 @@ def get_state_file_path(dest_name: str) -> Path:
     return ROOT / f"processed_notebooks_{dest_name}.json"
 
 
-def load_processed_log(dest_name: str):
-    log_path = get_state_file_path(dest_name)
-    if log_path.exists():
-        try:
-            with open(log_path, "r") as f:
-                data = json.load(f)
+class StateStore:
+    """
+    Processed logs (doc ID -> version) for every destination.
+    Updates are kept in memory and written by flush(), once per destination batch
+    (a destination's log is only rewritten if it changed).
+    """
+
+    def __init__(self):
+        self._states = {}
+        self._dirty = set()
+
+    def load(self, dest_name: str) -> dict:
+        if dest_name in self._states:
+            return self._states[dest_name]
+
+        data = {}
+        log_path = get_state_file_path(dest_name)
+        if log_path.exists():
+            try:
+                raw = log_path.read_bytes()
+                data = orjson.loads(raw) if orjson is not None else json.loads(raw)
                 # Handle legacy format (list of IDs) - backward compatibility
                 if isinstance(data, list):
-                    return {doc_id: 0 for doc_id in data}
+                    data = {doc_id: 0 for doc_id in data}
                 # Handle new format (dict of ID -> Version)
-                return data
-        except Exception:
-            return {}
-    return {}
+            except Exception:
+                data = {}
+
+        self._states[dest_name] = data
+        return data
+
+    def set(self, dest_name: str, doc_id, version):
+        state = self.load(dest_name)
+        if doc_id in state and state[doc_id] == version:
+            return
+        state[doc_id] = version
+        self._dirty.add(dest_name)
+
+    def flush(self):
+        """Write (and fsync) every processed log that changed since the last flush."""
+        for dest_name in sorted(self._dirty):
+            state = self._states[dest_name]
+            if orjson is not None:
+                data = orjson.dumps(state, option=orjson.OPT_INDENT_2 | orjson.OPT_SORT_KEYS)
+            else:
+                data = json.dumps(state, indent=2, sort_keys=True).encode("utf-8")
+
+            path = get_state_file_path(dest_name)
+            # Write a temp file and rename it over the log, so a crash mid-write
+            # leaves the previous log intact rather than a truncated one
+            fd, tmp_name = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp")
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    f.write(data)
+                    # Durable before the rename, so a crash right after can't lose the state
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(tmp_name, path)
+            except BaseException:
+                Path(tmp_name).unlink(missing_ok=True)
+                raise
+        self._dirty.clear()
+
+
+STATE = StateStore()
+# Backstop for exits that skip main()'s flush; a no-op once everything is written
+atexit.register(STATE.flush)
+
+
+_PAGE_RE = re.compile(r"\.page-(\d+)\.png$")
+
+
+def _page_sort_key(name: str):
+    """Order rendered pages by page number (page-2 before page-10), other names last."""
+    m = _PAGE_RE.search(name)
+    return (0, int(m.group(1)), "") if m else (1, 0, name)
+
+
+def list_white_pngs() -> List[str]:
+    """Sorted names of all white-background PNGs in WHITE_DIR."""
+    # scandir entries carry the name, so no Path is built per file
+    with os.scandir(WHITE_DIR) as it:
+        return sorted(e.name for e in it if e.name.lower().endswith(".png"))
+
+
+def scan_page_pngs(prefix: str, white_pngs: Optional[List[str]] = None) -> List[Path]:
+    """
+    White-background PNGs whose names start with prefix, in page order, taken
+    from a list_white_pngs() listing (WHITE_DIR is scanned if none is given).
+    """
+    if white_pngs is None:
+        white_pngs = list_white_pngs()
+    # Names sharing a prefix are adjacent in the sorted listing, so binary-search to
+    # the first one instead of testing every name for every notebook
+    matches = []
+    for name in itertools.islice(white_pngs, bisect.bisect_left(white_pngs, prefix), None):
+        if not name.startswith(prefix):
+            break
+        matches.append(name)
+    matches.sort(key=_page_sort_key)
+    return [WHITE_DIR / name for name in matches]
+
+
+def get_val(item, key):
+    # Support both dict and object attribute access
+    if isinstance(item, dict):
+        return item.get(key)
+    return getattr(item, key, None)
+
+
+class NotebookMeta(NamedTuple):
+    """The fields main() needs from a collection item, read once up front."""
+
+    id: str
+    name: Optional[str]
+    parent: Optional[str]
+    type: Optional[str]
+    # Value stored in the processed logs: hash, else legacy integer Version (default 1)
+    version: Any
+    files: list
+    # The client's own item, as passed back to client.download()
+    item: Any
+
+
+def to_notebook_meta(item) -> NotebookMeta:
+    version = get_val(item, "hash")
+    if not version:
+        try:
+            version = int(get_val(item, "Version"))
+        except (ValueError, TypeError):
+            version = 1
+    return NotebookMeta(
+        id=get_val(item, "ID"),
+        name=get_val(item, "VissibleName") or get_val(item, "VisibleName"),
+        parent=get_val(item, "Parent"),
+        type=get_val(item, "Type"),
+        version=version,
+        files=get_val(item, "files") or [],
+        item=item,
+    )
 
 
-def add_to_processed_log(dest_name: str, doc_id, version):
-    processed = load_processed_log(dest_name)
-    processed[doc_id] = version
-    log_path = get_state_file_path(dest_name)
-    with open(log_path, "w") as f:
-        json.dump(processed, f, indent=2, sort_keys=True)
+def format_pages(texts: List[str]) -> str:
+    """Join page texts under "--- Page N ---" markers, as saved in the OCR output files."""
+    return "".join(f"--- Page {i} ---\n{(t or '').strip()}\n\n" for i, t in enumerate(texts, 1))
 
 
-def find_notebook_images(notebook_name: str):
-    imgs = sorted([p for p in WHITE_DIR.iterdir() if p.name.startswith(notebook_name)])
-    return imgs
+def format_note_text(texts: List[str]) -> str:
+    """
+    Page texts as published to destinations: the same "--- Page N ---" markers as
+    format_pages(), with two extra blank lines between pages. Built in one pass.
+    """
+    if not texts:
+        return ""
+    pages = (f"--- Page {i} ---\n{(t or '').strip()}" for i, t in enumerate(texts, 1))
+    return "\n\n\n\n".join(pages) + "\n\n"
 
 
-def preprocess_image(in_path: Path, out_path: Path):
+def read_cached_text(path: Path, source: Path) -> Optional[str]:
+    """Contents of path if it was written after source last changed, else None."""
+    try:
+        if path.stat().st_mtime >= source.stat().st_mtime:
+            return path.read_text(encoding="utf-8")
+    except OSError:
+        pass
+    return None
+
+
+def page_hash(path: Path) -> str:
+    """Content hash of a page image, the key of its entry in OCR_CACHE_DIR."""
+    data = path.read_bytes()
+    if blake3 is not None:
+        return blake3.blake3(data, max_threads=blake3.blake3.AUTO).hexdigest(length=16)
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def write_text_atomic(path: Path, text: str):
+    """Write text via a temp file, so concurrent readers never see a partial file."""
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(text)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+@functools.cache
+def _pyvips():
+    """
+    pyvips if installed (libvips preprocesses pages faster and in less memory than PIL),
+    else None. Imported on first use, so processes that never preprocess a page (the
+    parent, workers whose notebooks are unchanged) don't load libvips.
+    """
+    try:
+        import pyvips
+    except (ImportError, OSError):  # OSError: pyvips installed but libvips missing
+        return None
+    return pyvips
+
+
+def preprocess_settings() -> dict:
+    """The settings that shape preprocessed pages, as recorded next to them in VISION_DIR."""
+    return {
+        "max_edge": VISION_MAX_EDGE,
+        "jpeg_quality": VISION_JPEG_QUALITY,
+        "enhance": PREPROC_ENHANCE,
+    }
+
+
+def check_preprocess_settings():
+    """
+    Clear VISION_DIR if its pages were preprocessed with other settings (or unknown
+    ones), since preprocess_image() only compares mtimes, then record the current
+    settings. The OCR text saved next to each page goes with it; OCR_CACHE_DIR is
+    keyed by the preprocessed image itself, so it stays valid.
+    """
+    marker = VISION_DIR / ".settings.json"
+    settings = preprocess_settings()
+    try:
+        if json.loads(marker.read_text(encoding="utf-8")) == settings:
+            return
+    except (OSError, ValueError):
+        pass
+    if any(VISION_DIR.iterdir()):
+        log("Preprocessing settings changed; discarding preprocessed pages")
+        shutil.rmtree(VISION_DIR, ignore_errors=True)
+        VISION_DIR.mkdir(exist_ok=True)
+    marker.write_text(json.dumps(settings), encoding="utf-8")
+
+
+def preprocess_image(in_path: Path, out_path: Path) -> Path:
+    """
+    Prepare a page for OCR. Writes a JPEG next to out_path and returns its path.
+    Pages whose JPEG is already newer than the source image are left as they are
+    (check_preprocess_settings() clears them when the settings change).
+    """
+    from PIL import Image, ImageFilter, ImageOps
+
+    out_path = out_path.with_suffix(".jpg")
+    try:
+        if out_path.stat().st_mtime >= in_path.stat().st_mtime:
+            return out_path
+    except FileNotFoundError:
+        pass
+
     im = Image.open(in_path)
+
+    # Nothing to do for an opaque JPEG at the right size: copy it instead of re-encoding
+    scale = min(1.5, VISION_MAX_EDGE / max(im.size))
+    if (
+        not PREPROC_ENHANCE
+        and im.format == "JPEG"
+        and im.mode in ("RGB", "L")
+        and abs(scale - 1.0) <= 0.01
+    ):
+        im.close()
+        out_path.parent.mkdir(parents=True, exist_ok=True)
+        shutil.copyfile(in_path, out_path)
+        return out_path
+
+    if _pyvips() is not None:
+        im.close()
+        out_path.parent.mkdir(parents=True, exist_ok=True)
+        _preprocess_image_vips(in_path, out_path, scale)
+        return out_path
+
+    if im.format == "JPEG":
+        # libjpeg can decode straight to 1/2, 1/4 or 1/8 scale when the page will be
+        # downscaled anyway; draft() never goes below the requested size
+        w, h = im.size
+        im.draft("RGB", (round(w * scale), round(h * scale)))
+
     # Always composite onto a white background, regardless of mode
     if im.mode in ("RGBA", "LA") or (im.mode == "P" and "transparency" in im.info):
         bg = Image.new("RGBA", im.size, (255, 255, 255, 255))
@@ -273,84 +619,263 @@ def preprocess_image(in_path: Path, out_path: Path):
         im = im.convert("RGB")
 
     # Autocontrast
-    im = ImageOps.autocontrast(im, cutoff=2)
+    if PREPROC_ENHANCE:
+        im = ImageOps.autocontrast(im, cutoff=2)
 
-    # Upscale 1.5x (rounded)
+    # Upscale small pages (up to 1.5x), downscale anything above the image budget
     w, h = im.size
-    im = im.resize((int(w * 1.5), int(h * 1.5)), resample=Image.Resampling.LANCZOS)
+    scale = min(1.5, VISION_MAX_EDGE / max(w, h))
+    if abs(scale - 1.0) > 0.01:
+        im = im.resize(
+            (round(w * scale), round(h * scale)), resample=Image.Resampling.LANCZOS
+        )
 
-    # Sharpen
-    im = im.filter(ImageFilter.SHARPEN)
+    # Sharpen: one unsharp-mask pass tuned for pen strokes at OCR resolution
+    if PREPROC_ENHANCE:
+        im = im.filter(ImageFilter.UnsharpMask(radius=1.2, percent=120, threshold=3))
 
     out_path.parent.mkdir(parents=True, exist_ok=True)
-    im.save(out_path, quality=95)
+    im.save(out_path, "JPEG", quality=VISION_JPEG_QUALITY, optimize=True)
+    return out_path
 
 
-# --- Google Vision OCR using API key (legacy) ---
-def vision_ocr_image(png_path: Path, api_key: str, retries: int = 3):
-    import base64
+def _vips_autocontrast(im, cutoff: float = 2):
+    """
+    Stretch each band's cutoff..(100 - cutoff) percentile range to 0..255, band by
+    band like ImageOps.autocontrast(cutoff=...); flat bands are left as they are.
+    """
+    scales, offsets = [], []
+    for band in im.bandsplit():
+        lo, hi = band.percent(cutoff), band.percent(100 - cutoff)
+        scale = 255 / (hi - lo) if hi > lo else 1.0
+        scales.append(scale)
+        offsets.append(-lo * scale if hi > lo else 0.0)
+    return im.linear(scales, offsets, uchar=True)
 
-    import requests
 
-    with open(png_path, "rb") as f:
-        content_b64 = base64.b64encode(f.read()).decode("utf-8")
+def _preprocess_image_vips(in_path: Path, out_path: Path, scale: float):
+    """
+    libvips version of preprocess_image(): the same steps as one pipeline, so each
+    page is decoded and encoded once and never held in memory as a whole.
+    """
+    im = _pyvips().Image.new_from_file(str(in_path))
+    if im.hasalpha():
+        im = im.flatten(background=[255] * (im.bands - 1))
+    im = im.colourspace("srgb")
 
-    url = f"https://vision.googleapis.com/v1/images:annotate?key={api_key}"
-    payload = {
-        "requests": [
-            {
-                "image": {"content": content_b64},
-                "features": [{"type": "DOCUMENT_TEXT_DETECTION"}],
-            }
-        ]
-    }
+    if PREPROC_ENHANCE:
+        im = _vips_autocontrast(im)
+
+    if abs(scale - 1.0) > 0.01:
+        im = im.resize(scale, kernel="lanczos3")
+
+    if PREPROC_ENHANCE:
+        im = im.sharpen(sigma=1.2)
+
+    im.jpegsave(str(out_path), Q=VISION_JPEG_QUALITY, optimize_coding=True, strip=True)
+
+
+# --- Google Vision OCR using service account ---
+# Longest wait between retries of a rate-limited or unavailable Vision call
+VISION_MAX_BACKOFF = 60.0
 
-    backoff = 1
-    for attempt in range(1, retries + 1):
-        try:
-            resp = requests.post(url, json=payload, timeout=60)
-            if resp.status_code == 200:
-                data = resp.json()
-                r = data.get("responses", [None])[0]
-                if r and "fullTextAnnotation" in r:
-                    return r["fullTextAnnotation"].get("text", "").strip()
-                return ""
-            elif resp.status_code in (429, 500, 502, 503, 504):
-                time.sleep(backoff)
-                backoff *= 2
-                continue
-            else:
-                # authentication or client error — stop retrying
-                print("Vision API error", resp.status_code, resp.text)
-                return None
-        except Exception:
-            time.sleep(backoff)
-            backoff *= 2
-    return None
 
+def _vision_transient_errors() -> tuple:
+    """Vision errors worth retrying: quota (429), server errors (500/503) and timeouts (504)."""
+    from google.api_core import exceptions as google_exceptions
 
-# --- Google Vision OCR using service account (preferred) ---
-def vision_ocr_image_service_account(png_path: Path):
+    return (
+        google_exceptions.ResourceExhausted,
+        google_exceptions.InternalServerError,
+        google_exceptions.ServiceUnavailable,
+        google_exceptions.DeadlineExceeded,
+    )
+
+
+def _vision_async_client():
+    """
+    ImageAnnotatorAsyncClient for one OCR run, shared by all of its batches so the
+    auth/channel setup happens once. asyncio channels belong to their event loop, so
+    the caller closes it (client.transport.close()) before the loop ends.
+    Returns None if google-cloud-vision is not installed.
+    """
     try:
         from google.cloud import vision
+        from google.cloud.vision_v1.services.image_annotator.transports import (
+            ImageAnnotatorGrpcAsyncIOTransport,
+        )
     except ImportError:
         print("google-cloud-vision not installed. Please run: uv add google-cloud-vision")
         return None
 
-    client = vision.ImageAnnotatorClient()
-    with open(png_path, "rb") as f:
-        content = f.read()
-    image = vision.Image(content=content)
-    response = client.document_text_detection(image=image)
-    if response.error.message:
-        print(f"Vision API error: {response.error.message}")
-        return None
-    if response.full_text_annotation and response.full_text_annotation.text:
-        return response.full_text_annotation.text.strip()
-    return ""
+    channel = ImageAnnotatorGrpcAsyncIOTransport.create_channel(options=VISION_GRPC_OPTIONS)
+    return vision.ImageAnnotatorAsyncClient(
+        transport=ImageAnnotatorGrpcAsyncIOTransport(channel=channel)
+    )
+
+
+def _vision_chunks(paths: List[Path]) -> List[List[Path]]:
+    """Group pages into batch requests of at most VISION_BATCH_SIZE images / MAX_BYTES."""
+    chunks = []
+    current = []
+    current_bytes = 0
+    for p in paths:
+        size = p.stat().st_size
+        if current and (
+            len(current) >= VISION_BATCH_SIZE or current_bytes + size > VISION_BATCH_MAX_BYTES
+        ):
+            chunks.append(current)
+            current = []
+            current_bytes = 0
+        current.append(p)
+        current_bytes += size
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+async def vision_ocr_batch(
+    paths: List[Path], client, sem: asyncio.Semaphore, retries: int = 3
+) -> List[Optional[str]]:
+    """
+    OCR several pages with Google Vision using batched requests on `client` (see
+    _vision_async_client). Each request holds `sem` while in flight; callers share one
+    semaphore across calls to cap the requests of a whole run. Rate-limited,
+    failing or timed-out requests are retried with exponential backoff (capped at
+    VISION_MAX_BACKOFF seconds).
+    Returns one text per path in input order (None where OCR failed).
+    """
+    if client is None:
+        return [None] * len(paths)
+
+    from google.cloud import vision
+
+    transient_errors = _vision_transient_errors()
+    feature = vision.Feature(type_=vision.Feature.Type.DOCUMENT_TEXT_DETECTION)
+
+    async def ocr_chunk(chunk: List[Path]) -> List[Optional[str]]:
+        requests = [
+            vision.AnnotateImageRequest(
+                image=vision.Image(content=p.read_bytes()), features=[feature]
+            )
+            for p in chunk
+        ]
+        async with sem:
+            backoff = 1
+            for attempt in range(1, retries + 1):
+                try:
+                    response = await client.batch_annotate_images(requests=requests)
+                    break
+                except transient_errors as e:
+                    if attempt == retries:
+                        print(f"Vision API error: {e}")
+                        return [None] * len(chunk)
+                    await asyncio.sleep(backoff)
+                    backoff = min(VISION_MAX_BACKOFF, backoff * 2)
+                except Exception as e:
+                    print(f"Vision API error: {e}")
+                    return [None] * len(chunk)
+
+        texts = []
+        for r in response.responses:
+            if r.error.message:
+                print(f"Vision API error: {r.error.message}")
+                texts.append(None)
+            elif r.full_text_annotation and r.full_text_annotation.text:
+                texts.append(r.full_text_annotation.text.strip())
+            else:
+                texts.append("")
+        return texts
+
+    results = await asyncio.gather(*(ocr_chunk(chunk) for chunk in _vision_chunks(paths)))
+    return [text for chunk_texts in results for text in chunk_texts]
+
+
+async def preprocess_and_ocr(imgs: List[Path], out_paths: List[Path], executor):
+    """
+    Preprocess pages on `executor` and OCR them, as a pipeline: a Vision batch is sent
+    as soon as VISION_BATCH_SIZE pages are ready, while later pages are still being
+    preprocessed. Pages whose preprocessed image is older than their saved OCR text,
+    or whose content hash is in OCR_CACHE_DIR, are reused instead, and identical pages
+    (e.g. blank template pages) are sent to Vision only once.
+    Returns (preprocessed paths, raw OCR texts), both in page order.
+    """
+    loop = asyncio.get_running_loop()
+    pending = [
+        loop.run_in_executor(executor, preprocess_image, img, out)
+        for img, out in zip(imgs, out_paths)
+    ]
+
+    pre_paths = []
+    raw_texts = []
+    hashes = {}  # page index -> content hash, for pages sent to Vision
+    first_by_hash = {}  # content hash -> index of the page sent to Vision for it
+    duplicates = {}  # page index -> index of an identical page sent to Vision
+    batches = []  # (page indices, task OCRing those pages)
+    todo = []
+    client = None  # created with the first batch; fully cached notebooks never connect
+    # Batches are started as pages become ready; this caps how many run at once
+    sem = asyncio.Semaphore(max(1, VISION_CONCURRENCY))
+    try:
+        for i, fut in enumerate(pending):
+            pre = await fut
+            pre_paths.append(pre)
+            txt = read_cached_text(pre.with_suffix(".txt"), pre)
+            if txt is None:
+                h = page_hash(pre)
+                try:
+                    txt = (OCR_CACHE_DIR / f"{h}.txt").read_text(encoding="utf-8")
+                except FileNotFoundError:
+                    if h in first_by_hash:
+                        duplicates[i] = first_by_hash[h]
+                    else:
+                        hashes[i] = h
+                        first_by_hash[h] = i
+                else:
+                    pre.with_suffix(".txt").write_text(txt, encoding="utf-8")
+            raw_texts.append(txt)
+            if txt is None and i not in duplicates:
+                todo.append(i)
+            if todo and (len(todo) == VISION_BATCH_SIZE or i == len(pending) - 1):
+                log(f"Vision OCR (service account): {len(todo)} pages")
+                if not batches:
+                    client = _vision_async_client()
+                batch = [pre_paths[j] for j in todo]
+                task = asyncio.create_task(vision_ocr_batch(batch, client, sem))
+                batches.append((todo, task))
+                todo = []
+
+        cached = len(pre_paths) - len(duplicates) - sum(len(indices) for indices, _ in batches)
+        if cached:
+            log(f"Reusing cached OCR text for {cached} pages")
+        if duplicates:
+            log(f"Reusing OCR text of identical pages for {len(duplicates)} pages")
+
+        for indices, task in batches:
+            for i, txt in zip(indices, await task):
+                if txt is None:
+                    log(f"Vision failed for {pre_paths[i]}")
+                else:
+                    pre_paths[i].with_suffix(".txt").write_text(txt, encoding="utf-8")
+                    # Notebooks may be OCR'd in parallel processes that share the cache
+                    write_text_atomic(OCR_CACHE_DIR / f"{hashes[i]}.txt", txt)
+
+                raw_texts[i] = txt or ""
+
+        for i, first in duplicates.items():
+            raw_texts[i] = raw_texts[first]
+            if raw_texts[i]:
+                pre_paths[i].with_suffix(".txt").write_text(raw_texts[i], encoding="utf-8")
+    finally:
+        if client is not None:
+            await client.transport.close()
+
+    return pre_paths, raw_texts
 
 
 def make_pdf_from_images(image_paths, out_pdf: Path):
+    from PIL import Image
+
     imgs = []
     for p in image_paths:
         # Open and ensure consistent RGB mode (avoiding potentially problematic RGBA/transparency issues in PDF)
@@ -390,15 +915,30 @@ def make_pdf_from_images(image_paths, out_pdf: Path):
         return out_pdf
 
 
+@functools.lru_cache(maxsize=1024)
 def sanitize_filename(name: str) -> str:
     """Replace / and other problematic characters in notebook names for safe file paths."""
     return name.replace("/", "_").replace("\\", "_").replace(" ", "_")
 
 
+# (pid, file) of this process's log file, opened on first use. It is line-buffered, so
+# every line reaches LOG_PATH as it is logged, and appends, so worker processes can
+# share the file; a forked worker reopens it rather than using the parent's handle.
+_LOG_FILE = None
+
+
 def log(msg):
+    global _LOG_FILE
     print(msg)
-    with open(LOG_PATH, "a", encoding="utf-8") as f:
-        f.write(f"{datetime.datetime.now().isoformat()} {msg}\n")
+    if _LOG_FILE is None or _LOG_FILE[0] != os.getpid():
+        _LOG_FILE = (os.getpid(), open(LOG_PATH, "a", encoding="utf-8", buffering=1))
+    _LOG_FILE[1].write(f"{datetime.datetime.now().isoformat()} {msg}\n")
+
+
+def log_exception(e: BaseException):
+    """Log the traceback of e, in debug mode only."""
+    if DEBUG:
+        log("".join(traceback.format_exception(type(e), e, e.__traceback__)))
 
 
 def validate_environment():
@@ -418,7 +958,7 @@ def validate_environment():
         )
 
     # 2. Check Google Credentials
-    # The config loader above sets GOOGLE_APPLICATION_CREDENTIALS if a key exists in config.yml
+    # load_config() sets GOOGLE_APPLICATION_CREDENTIALS if a key exists in config.yml
     # Or users might have put a file in secrets/ (legacy)
     has_creds = False
 
@@ -472,11 +1012,146 @@ def validate_environment():
     log("Configuration valid.")
 
 
+def render_zip_page(zip_path: Path, page: int, out_path: Path) -> bool:
+    """Render one page of a notebook zip to out_path. Returns False if it couldn't be rendered."""
+    from remarkable_mcp.extract import render_page_from_document_zip
+
+    png_bytes = render_page_from_document_zip(zip_path, page)
+    if png_bytes is None:
+        return False
+    # Save as PNG with white background
+    with open(out_path, "wb") as out_f:
+        out_f.write(png_bytes)
+    return True
+
+
+def render_notebook_zip(zip_path: Path, safe_notebook: str, notebook: str, executor=None):
+    """
+    Render every page of a downloaded notebook zip into WHITE_DIR, then delete the zip.
+    Pages are independent, so they are rendered on `executor` when one is given.
+    Returns the paths of the rendered pages, in page order.
+    """
+    from remarkable_mcp.extract import get_document_page_count
+
+    # Get page count
+    page_count = get_document_page_count(zip_path)
+    log(f"Rendering {page_count} pages for {notebook}...")
+    pages = range(1, page_count + 1)
+    out_paths = [WHITE_DIR / f"{safe_notebook}.page-{page}.png" for page in pages]
+    if executor is not None and page_count > 1:
+        rendered = executor.map(render_zip_page, [zip_path] * page_count, pages, out_paths)
+    else:
+        rendered = map(render_zip_page, [zip_path] * page_count, pages, out_paths)
+    # Logged here rather than in render_zip_page(), which may run in another process
+    saved = []
+    for page, out_path, ok in zip(pages, out_paths, rendered):
+        if ok:
+            log(f"Saved: {out_path}")
+            saved.append(out_path)
+        else:
+            log(f"Failed to render page {page} of {notebook}.")
+    # Remove temp zip
+    zip_path.unlink(missing_ok=True)
+    return saved
+
+
+def process_notebook(work: dict, preprocess_executor=None) -> dict:
+    """
+    Render (if needed), preprocess, OCR and clean up one notebook.
+
+    Runs inside a worker process when several notebooks are processed at once, so it
+    only takes and returns picklable data: `work` is built by main(), and the result
+    carries the notebook's id, name and version plus a PublishJob (None on failure).
+    Pages are rendered and preprocessed on preprocess_executor when one is given;
+    without it, they are rendered one by one and preprocessed on a thread pool.
+    """
+    notebook = work["notebook"]
+    safe_notebook = work["safe_notebook"]
+    result = {"id": work["id"], "notebook": notebook, "version": work["version"], "job": None}
+
+    try:
+        imgs = work["imgs"]
+        if work["zip"] is not None:
+            # The rendered pages are known, so WHITE_DIR isn't scanned again
+            imgs = render_notebook_zip(
+                work["zip"], safe_notebook, notebook, preprocess_executor
+            )
+            if not imgs:
+                log(f"Failed to generate white-background PNGs for {notebook} from cloud. Exiting.")
+                return result
+            version_marker = WHITE_DIR / f"{safe_notebook}.version"
+            version_marker.write_text(str(work["version"]), encoding="utf-8")
+        img_names = [p.name for p in imgs]
+        log(f"Found {len(imgs)} white-background PNGs for {notebook}: {img_names}")
+
+        # Preprocess images
+        pre_dir = VISION_DIR / safe_notebook
+        pre_dir.mkdir(parents=True, exist_ok=True)
+        out_paths = [pre_dir / name for name in img_names]
+
+        # Preprocess, then OCR via Google Vision (always use service account)
+        if preprocess_executor is not None:
+            pre_paths, raw_texts = asyncio.run(
+                preprocess_and_ocr(imgs, out_paths, preprocess_executor)
+            )
+        else:
+            # Worker processes can't start their own process pool; PIL releases the GIL
+            with ThreadPoolExecutor(max_workers=max(1, PREPROC_CONCURRENCY)) as ex:
+                pre_paths, raw_texts = asyncio.run(preprocess_and_ocr(imgs, out_paths, ex))
+
+        # Clean all pages together so the prompt is sent once per batch, not once per page
+        log(f"  Cleaning text with OpenAI for {len(raw_texts)} pages...")
+        cleaned_texts = repair_texts_with_openai(raw_texts, cache_dir=REPAIR_CACHE_DIR)
+
+        # Save RAW text
+        raw_out_txt = OCR_DIR / f"{safe_notebook}_raw.txt"
+        meta_line = json.dumps({"notebook": notebook, "images": img_names})
+        raw_out_txt.write_text(meta_line + "\n\n" + format_pages(raw_texts), encoding="utf-8")
+        log(f"Raw OCR text saved to {raw_out_txt}")
+
+        # Save CLEANED text (this is what goes to Apple Notes)
+        clean_out_txt = OCR_DIR / f"{safe_notebook}_clean.txt"
+        clean_out_txt.write_text(meta_line + "\n\n" + format_pages(cleaned_texts), encoding="utf-8")
+        log(f"Cleaned OCR text saved to {clean_out_txt}")
+
+        # Build PDF from the white PNGs - DISABLED for performance
+        # out_pdf = PDF_DIR / f'{safe_notebook}.pdf'
+        # make_pdf_from_images(imgs, out_pdf)
+        # log(f'PDF created: {out_pdf}')
+
+        # Format text (the saved file's pages, spaced out, without its metadata line)
+        clean_text = format_note_text(cleaned_texts)
+
+        result["job"] = PublishJob(
+            notebook_name=work["display_title"],
+            text_content=clean_text,
+            image_paths=imgs,
+            sub_folder=work["sub_folder"],
+        )
+    except Exception as e:
+        log(f"Failed processing notebook {notebook}: {e}")
+        log_exception(e)
+
+    return result
+
+
+def init_notebook_worker(processes: int):
+    """
+    Pool initializer for notebook workers: each OCRs and cleans up with its share of
+    VISION_CONCURRENCY and of the OpenAI rate limits and concurrency, so that together
+    they stay within the configured limits.
+    """
+    global VISION_CONCURRENCY
+    share_limits(processes)
+    VISION_CONCURRENCY = max(1, VISION_CONCURRENCY // max(1, processes))
+
+
 def main():
     # At the start of main(), clear the log for a new run
     with open(LOG_PATH, "w", encoding="utf-8") as f:
         f.write("")
 
+    load_config()
     validate_environment()
 
     log("Pipeline started.")
@@ -491,59 +1166,56 @@ def main():
         help="Apple Notes folder name",
     )
     parser.add_argument("--state-file", help="Ignored (legacy compatibility)")
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="Discard cached renders, preprocessed images, OCR and cleaned text before running",
+    )
     args = parser.parse_args()
 
-    # --- Cleanup all cached files for all notebooks at the start of each run ---
-    import shutil
-    # Clean all output folders (PNG, OCR, PDF, Vision) at the start of each run
-    for folder in [WHITE_DIR, VISION_DIR, OCR_DIR, PDF_DIR]:
-        if folder.exists():
-            for item in folder.iterdir():
-                if item.is_file():
-                    item.unlink()
-                elif item.is_dir():
-                    shutil.rmtree(item)
-    # Ensure output folders exist after cleanup
-    for folder in [WHITE_DIR, VISION_DIR, OCR_DIR, PDF_DIR]:
+    # --- Cached files are reused across runs; --force clears them all ---
+    # Clean all output folders (PNG, OCR, PDF, Vision) when forced
+    # Removing each folder whole is far cheaper than unlinking its files one by one
+    if args.force:
+        shutil.rmtree(REPAIR_CACHE_DIR, ignore_errors=True)
+    for folder in [WHITE_DIR, VISION_DIR, OCR_DIR, PDF_DIR, OCR_CACHE_DIR]:
+        if args.force:
+            shutil.rmtree(folder, ignore_errors=True)
+        # Ensure output folders exist after cleanup
         folder.mkdir(exist_ok=True)
+    check_preprocess_settings()
 
     # --- Step 0: List all notebooks ---
     from remarkable_mcp.api import get_rmapi
 
     client = get_rmapi()
-    collection = client.get_meta_items()
-
-    # Only consider notebooks (not PDFs/EPUBs)
-    def get_val(item, key):
-        # Support both dict and object attribute access
-        if isinstance(item, dict):
-            return item.get(key)
-        return getattr(item, key, None)
+    # Normalize items once; everything below reads plain tuple fields
+    collection = [to_notebook_meta(item) for item in client.get_meta_items()]
 
     # Build ID map for path resolution
-    id_map = {get_val(item, "ID"): item for item in collection}
+    id_map = {item.id: item for item in collection}
+    path_cache = {}
 
     def get_notebook_path(item, id_map):
-        path = []
-        current = item
-        while get_val(current, "Parent"):
-            parent_id = get_val(current, "Parent")
-            if parent_id == "trash":
-                path.insert(0, "[TRASH]")
-                break
-            parent = id_map.get(parent_id)
+        """Folder path of item, e.g. "Work / Project A"; built from its parent's cached path."""
+        path = path_cache.get(item.id)
+        if path is not None:
+            return path
+        path = ""
+        if item.parent == "trash":
+            path = "[TRASH]"
+        elif item.parent:
+            parent = id_map.get(item.parent)
             if parent:
-                parent_name = get_val(parent, "VissibleName") or get_val(parent, "VisibleName")
-                path.insert(0, parent_name)
-                current = parent
-            else:
-                break
-        return " / ".join(path)
+                parent_path = get_notebook_path(parent, id_map)
+                path = f"{parent_path} / {parent.name}" if parent_path else parent.name
+        path_cache[item.id] = path
+        return path
 
+    # Only consider notebooks (not PDFs/EPUBs)
     def is_native_notebook(item):
         """Check if document is a native notebook (not PDF/EPUB)."""
-        files = get_val(item, "files") or []
-        for f in files:
+        for f in item.files:
             fid = f.get("id", "").lower()
             if fid.endswith(".pdf") or fid.endswith(".epub"):
                 return False
@@ -553,8 +1225,8 @@ def main():
     candidates = [
         item
         for item in collection
-        if get_val(item, "Type") == "DocumentType"
-        and (get_val(item, "VissibleName") or get_val(item, "VisibleName"))
+        if item.type == "DocumentType"
+        and item.name
         and not get_notebook_path(item, id_map).startswith("[TRASH]")
     ]
 
@@ -579,33 +1251,25 @@ def main():
     dest_states = {}
     for dest in ACTIVE_DESTINATIONS:
         dest_name = type(dest).__name__
-        dest_states[dest_name] = load_processed_log(dest_name)
-
-    for item in notebooks:
-        doc_id = get_val(item, "ID")
-
-        # Prefer 'hash', fall back to 'Version' (legacy), default to 1
-        curr_val = get_val(item, "hash")
-        if not curr_val:
-            try:
-                curr_val = int(get_val(item, "Version"))
-            except (ValueError, TypeError):
-                curr_val = 1
+        dest_states[dest_name] = STATE.load(dest_name)
 
-        # Check against each ACTIVE destination
-        for dest in ACTIVE_DESTINATIONS:
-            dest_name = type(dest).__name__
-            last_val = dest_states[dest_name].get(doc_id, -1)
+    # Current version of every notebook ('hash', falling back to 'Version', default 1)
+    current = {item.id: str(item.version) for item in notebooks}
 
-            if str(last_val) != str(curr_val):
-                if doc_id not in needs_update:
-                    needs_update[doc_id] = []
-                needs_update[doc_id].append(dest)
+    # Check against each ACTIVE destination: the notebooks whose (ID, version) pair
+    # isn't in its processed log, found with one set difference
+    for dest in ACTIVE_DESTINATIONS:
+        processed = {
+            (doc_id, str(version))
+            for doc_id, version in dest_states[type(dest).__name__].items()
+        }
+        for doc_id, _ in current.items() - processed:
+            needs_update.setdefault(doc_id, []).append(dest)
 
     # Convert the needs_update map back into a list of notebooks to process
     notebooks_to_process_candidates = []
     for item in notebooks:
-        doc_id = get_val(item, "ID")
+        doc_id = item.id
         if doc_id in needs_update:
             notebooks_to_process_candidates.append(item)
 
@@ -624,8 +1288,7 @@ def main():
         log(f"Processing notebook: {target_name}")
         notebooks_to_process = []
         for item in notebooks_to_process_candidates:
-            name = get_val(item, "VissibleName") or get_val(item, "VisibleName")
-            if name == target_name:
+            if item.name == target_name:
                 notebooks_to_process.append(item)
 
         # Optimization: If the user forced --notebook, but we think it's up to date,
@@ -635,15 +1298,13 @@ def main():
             # Check if it exists at all
             exists = False
             for item in notebooks:
-                n = get_val(item, "VissibleName") or get_val(item, "VisibleName")
-                if n == target_name:
+                if item.name == target_name:
                     exists = True
                     # It exists but is considered processed. Let's force it for the 'single notebook' use case.
                     log(f"Notebook {target_name} is marked as up-to-date, but forcing due to --notebook flag.")
                     notebooks_to_process.append(item)
                     # Force all destinations for this single forced run
-                    doc_id = get_val(item, "ID")
-                    needs_update[doc_id] = ACTIVE_DESTINATIONS
+                    needs_update[item.id] = ACTIVE_DESTINATIONS
                     break
             
             if not exists:
@@ -652,19 +1313,32 @@ def main():
     else:
         notebooks_to_process = notebooks_to_process_candidates
 
+    # One listing of the rendered pages serves every notebook
+    white_pngs = list_white_pngs()
+
+    # Cheap per-notebook setup (cache checks, downloads) happens here; the heavy work
+    # is handed to process_notebook() as picklable work items
+    work_items = []
+    targets_by_id = {}
+    top_level_cache = {}  # folder_path -> sanitized top-level folder name
+    # Fallback: if 'needs_update' is empty (forced run), target all active
+    default_targets = ACTIVE_DESTINATIONS
     for nb_item in notebooks_to_process:
-        notebook = get_val(nb_item, "VissibleName") or get_val(nb_item, "VisibleName")
-        notebook_id = get_val(nb_item, "ID")
+        notebook = nb_item.name
+        notebook_id = nb_item.id
+
+        # Destinations that specifically request this notebook
+        targets = needs_update.get(notebook_id) or default_targets
+        if not targets:
+            # Nothing would use the result, so skip the download, OCR and cleanup
+            log("No destinations need update for this notebook (or none configured).")
+            # Marked as success because we did what was asked (nothing)
+            log(f"Notebook {notebook} processing complete.")
+            continue
+        targets_by_id[notebook_id] = targets
 
         # Get the value to store after processing (Hash or Version)
-        item_hash = get_val(nb_item, "hash")
-        if item_hash:
-            notebook_version = item_hash
-        else:
-            try:
-                notebook_version = int(get_val(nb_item, "Version"))
-            except (ValueError, TypeError):
-                notebook_version = 1
+        notebook_version = nb_item.version
 
         safe_notebook = sanitize_filename(notebook)
 
@@ -675,17 +1349,36 @@ def main():
         else:
             display_title = notebook
 
+        # Determine strict top-level folder name for nesting
+        # folder_path is like "Work / Project A" -> top_level is "Work"
+        top_level_subfolder = None
+        if folder_path:
+            top_level_subfolder = top_level_cache.get(folder_path)
+            if top_level_subfolder is None:
+                top_level_subfolder = sanitize_filename(folder_path.split(" / ", 1)[0])
+                top_level_cache[folder_path] = top_level_subfolder
+
         log(f"Processing notebook: {display_title} (ID: {notebook_id})")
         # Step 1: Pull and render notebook pages if not present
         # Use + '.' to ensure strict prefix matching (e.g. "Notebook_1." won't match "Notebook_10.")
         prefix_pattern = safe_notebook + "."
-        imgs = sorted(
-            [
-                p
-                for p in WHITE_DIR.iterdir()
-                if p.name.startswith(prefix_pattern) and p.suffix.lower() == ".png"
-            ]
-        )
+        imgs = scan_page_pngs(prefix_pattern, white_pngs)
+
+        # Cached pages are only valid for the notebook version they were rendered from
+        version_marker = WHITE_DIR / f"{safe_notebook}.version"
+        try:
+            cached_version = version_marker.read_text(encoding="utf-8")
+        except OSError:
+            cached_version = None
+        if imgs and cached_version != str(notebook_version):
+            log(f"Cached pages for {notebook} are out of date. Re-rendering...")
+            for p in imgs:
+                # The new version may have fewer pages, so drop every stale one
+                p.unlink(missing_ok=True)
+                (p.parent / f"opaque_{p.name}").unlink(missing_ok=True)
+            imgs = []
+
+        tmp_zip = None
         if not imgs:
             log(
                 f"No white-background PNGs found for {notebook}. Attempting to pull from reMarkable cloud..."
@@ -693,179 +1386,128 @@ def main():
             # Find the document by name
             doc = None
             for item in collection:
-                name1 = get_val(item, "VissibleName")
-                name2 = get_val(item, "VisibleName")
-                if (name1 and name1.strip() == notebook) or (name2 and name2.strip() == notebook):
+                if item.name and item.name.strip() == notebook:
                     doc = item
                     break
             if not doc:
                 log(f'Notebook "{notebook}" not found in your reMarkable cloud library. Exiting.')
                 continue
-            # Download the document zip (cloud: use client.download)
-            from remarkable_mcp.extract import (
-                get_document_page_count,
-                render_page_from_document_zip,
-            )
-
+            # Download the document zip (cloud: use client.download); pages are
+            # rendered by process_notebook()
             tmp_zip = ROOT / f"{safe_notebook}.zip"
-            raw_bytes = client.download(doc)
+            raw_bytes = client.download(doc.item)
             if not raw_bytes:
                 log(f"Failed to download notebook zip for {notebook} from cloud.")
                 continue
             with open(tmp_zip, "wb") as f:
                 f.write(raw_bytes)
-            # Get page count
-            page_count = get_document_page_count(tmp_zip)
-            log(f"Rendering {page_count} pages for {notebook}...")
-            for page in range(1, page_count + 1):
-                png_bytes = render_page_from_document_zip(tmp_zip, page)
-                if png_bytes is None:
-                    log(f"Failed to render page {page} of {notebook}.")
-                    continue
-                # Save as PNG with white background
-                with open(WHITE_DIR / f"{safe_notebook}.page-{page}.png", "wb") as out_f:
-                    out_f.write(png_bytes)
-                log(f"Saved: {WHITE_DIR / f'{safe_notebook}.page-{page}.png'}")
-            # Remove temp zip
-            tmp_zip.unlink(missing_ok=True)
-            # Re-scan for white PNGs
-            imgs = sorted(
-                [
-                    p
-                    for p in WHITE_DIR.iterdir()
-                    if p.name.startswith(prefix_pattern) and p.suffix.lower() == ".png"
-                ]
-            )
-            if not imgs:
-                log(f"Failed to generate white-background PNGs for {notebook} from cloud. Exiting.")
-                continue
-        log(f"Found {len(imgs)} white-background PNGs for {notebook}: {[p.name for p in imgs]}")
-
-        # Preprocess images
-        pre_dir = VISION_DIR / safe_notebook
-        pre_dir.mkdir(parents=True, exist_ok=True)
-        pre_paths = []
-        for p in imgs:
-            out_p = pre_dir / p.name
-            preprocess_image(p, out_p)
-            pre_paths.append(out_p)
-
-        # OCR via Google Vision (always use service account)
-        raw_texts = []
-        cleaned_texts = []
-        for p in pre_paths:
-            log(f"Vision OCR (service account): {p.name}")
-            txt = vision_ocr_image_service_account(p)
-            if txt is None:
-                log(f"Vision failed for {p}")
-
-            raw_text = txt or ""
-            raw_texts.append(raw_text)
-
-            log(f"  Cleaning text with OpenAI for {p.name}...")
-            cleaned_text = repair_text_with_openai(raw_text)
-            cleaned_texts.append(cleaned_text)
 
-        # Save RAW text
-        raw_out_txt = OCR_DIR / f"{safe_notebook}_raw.txt"
-        meta = {"notebook": notebook, "images": [p.name for p in imgs]}
-        with open(raw_out_txt, "w", encoding="utf-8") as f:
-            f.write(json.dumps(meta) + "\n\n")
-            for i, t in enumerate(raw_texts, 1):
-                f.write(f"--- Page {i} ---\n")
-                f.write((t or "").strip() + "\n\n")
-        log(f"Raw OCR text saved to {raw_out_txt}")
-
-        # Save CLEANED text (this is what goes to Apple Notes)
-        clean_out_txt = OCR_DIR / f"{safe_notebook}_clean.txt"
-        with open(clean_out_txt, "w", encoding="utf-8") as f:
-            f.write(json.dumps(meta) + "\n\n")
-            for i, t in enumerate(cleaned_texts, 1):
-                f.write(f"--- Page {i} ---\n")
-                f.write((t or "").strip() + "\n\n")
-        log(f"Cleaned OCR text saved to {clean_out_txt}")
-
-        # Build PDF from the white PNGs - DISABLED for performance
-        # out_pdf = PDF_DIR / f'{safe_notebook}.pdf'
-        # make_pdf_from_images(imgs, out_pdf)
-        # log(f'PDF created: {out_pdf}')
-
-        # Create Note (Apple Notes or Obsidian)
-        success = False
-        try:
-            # Prepare text content (extract from saved file)
-            full_text = clean_out_txt.read_text(errors="ignore") if clean_out_txt.exists() else ""
-
-            # Skip the first JSON line/metadata and find first page marker
-            lines = full_text.split("\n")
-            text_start = 0
-            for i, line in enumerate(lines):
-                if line.startswith("---"):
-                    text_start = i
-                    break
-            clean_text = "\n".join(lines[text_start:])
-
-            # Format text
-            clean_text = clean_text.replace("--- Page", "\n\n--- Page").lstrip()
+        work_items.append(
+            {
+                "notebook": notebook,
+                "id": notebook_id,
+                "version": notebook_version,
+                "safe_notebook": safe_notebook,
+                "display_title": display_title,
+                "sub_folder": top_level_subfolder,
+                "imgs": imgs,
+                "zip": tmp_zip,
+            }
+        )
 
-            # Determine strict top-level folder name for nesting
-            # folder_path is like "Work / Project A" -> top_level is "Work"
-            top_level_subfolder = None
-            if folder_path:
-                parts = folder_path.split(" / ")
-                if parts:
-                    top_level_subfolder = sanitize_filename(parts[0])
+    # Notebooks are independent, so several are processed at once in worker processes.
+    # A single notebook is processed here instead, spreading its pages over a process pool.
+    if len(work_items) > 1 and NOTEBOOK_CONCURRENCY > 1:
+        processes = min(NOTEBOOK_CONCURRENCY, len(work_items))
+        with multiprocessing.Pool(
+            processes=processes, initializer=init_notebook_worker, initargs=(processes,)
+        ) as pool:
+            results = list(pool.imap_unordered(process_notebook, work_items, chunksize=1))
+        # Publish in library order, not completion order
+        order = {work["id"]: i for i, work in enumerate(work_items)}
+        results.sort(key=lambda result: order[result["id"]])
+    else:
+        # Cleanup runs in this process: open its OpenAI connection while pages render
+        warm_up_connection()
+        # Preprocessing is CPU-bound PIL work, so pages are spread over worker processes
+        with ProcessPoolExecutor(max_workers=max(1, PREPROC_CONCURRENCY)) as preprocess_pool:
+            results = [process_notebook(work, preprocess_pool) for work in work_items]
+
+    pending_publish = []
+    for result in results:
+        notebook = result["notebook"]
+        if result["job"] is None:
+            log(f"Notebook {notebook} processing FAILED.")
+            continue
+
+        # Publishing is deferred until every notebook is ready, so each
+        # destination can publish the whole run in one batch
+        pending_publish.append(
+            {
+                "notebook": notebook,
+                "id": result["id"],
+                "version": result["version"],
+                "targets": targets_by_id[result["id"]],
+                "job": result["job"],
+                "success": True,
+            }
+        )
 
-            # Destinations that specifically request this notebook
-            targets = needs_update.get(notebook_id, [])
-            
-            # Fallback: if 'needs_update' is empty (forced run), target all active
-            if not targets and ACTIVE_DESTINATIONS:
-                 targets = ACTIVE_DESTINATIONS
+    # Publish all prepared notebooks: one batch per destination, so per-call
+    # setup (e.g. launching osascript) is paid once per run, not once per notebook.
+    # Destinations are independent, so their batches run concurrently.
+    batches = {}
+    for dest in ACTIVE_DESTINATIONS:
+        entries = [entry for entry in pending_publish if dest in entry["targets"]]
+        if entries:
+            batches[dest] = entries
 
-            if targets:
-                all_success = True
-                for dest in targets:
+    # Flush even if publishing raises, so notebooks already published aren't redone
+    try:
+        if batches:
+            with ThreadPoolExecutor(max_workers=len(batches)) as ex:
+                futures = {}
+                for dest, entries in batches.items():
+                    log(f"Publishing to {type(dest).__name__}...")
+                    future = ex.submit(dest.publish_batch, [entry["job"] for entry in entries])
+                    futures[future] = dest
+
+                # State is only updated here on the main thread, so it needs no lock
+                for future in as_completed(futures):
+                    dest = futures[future]
                     dest_name = type(dest).__name__
-                    log(f"Publishing to {dest_name}...")
-                    dest_success = dest.publish(
-                        notebook_name=display_title,
-                        text_content=clean_text,
-                        image_paths=imgs,
-                        sub_folder=top_level_subfolder,
-                    )
-                    if dest_success:
-                        # Update state for THIS destination immediately
-                        add_to_processed_log(dest_name, notebook_id, notebook_version)
-                    else:
-                        all_success = False
-                        log(f"⚠️ Failed to publish to {dest_name}")
-
-                success = all_success
-            else:
-                log("No destinations need update for this notebook (or none configured).")
-                success = True # Marked as success because we did what was asked (nothing)
-
-        except Exception as e:
-            log(f"Failed publishing note: {e}")
-            import traceback
-
-            log(traceback.format_exc())
-
-        # Legacy log update (kept to avoid breakage if referenced elsewhere, but logically handled above)
-        # We don't really need a 'global' success anymore, as per-dest success is what matters.
-        if success:
-             log(f"Notebook {notebook} processing complete.")
+                    entries = batches[dest]
+                    try:
+                        published = future.result()
+                    except Exception as e:
+                        log(f"Failed publishing to {dest_name}: {e}")
+                        log_exception(e)
+                        published = [False] * len(entries)
+
+                    for entry, dest_success in zip(entries, published):
+                        if dest_success:
+                            # Update state for THIS destination
+                            STATE.set(dest_name, entry["id"], entry["version"])
+                        else:
+                            entry["success"] = False
+                            log(f"⚠️ Failed to publish {entry['notebook']} to {dest_name}")
+                    # Persist each destination as soon as its batch is done: another
+                    # destination may still be publishing when the process is killed
+                    STATE.flush()
+    finally:
+        STATE.flush()
+
+    for entry in pending_publish:
+        if entry["success"]:
+            log(f"Notebook {entry['notebook']} processing complete.")
         else:
-             log(f"Notebook {notebook} processing FAILED.")
+            log(f"Notebook {entry['notebook']} processing FAILED.")
 
     log("Pipeline finished.")
 
 
 if __name__ == "__main__":
     # Required for PyInstaller to handle multiprocessing correctly (especially to avoid infinite spawn loops)
-    import multiprocessing
-
     multiprocessing.freeze_support()
 
     log(f"Script started. Working directory: {os.getcwd()}. Log path: {LOG_PATH.resolve()}")
@@ -1,32 +1,58 @@
 #!/usr/bin/env python3
 import sys
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 
 from PIL import Image
 
+# Ensure remarkable_mcp is importable
+sys.path.append(str(Path(__file__).parent.parent))
+
+# Same white compositing (vectorized when NumPy is installed) and PNG zlib level as
+# the Apple Notes attachments; these are intermediate files, so encode speed wins
+from remarkable_mcp.destinations import PNG_COMPRESS_LEVEL, flatten_on_white
+
 IN = Path("remarkable_pngs")
 OUT = Path("remarkable_pngs_white")
-OUT.mkdir(exist_ok=True)
-
-if not IN.exists():
-    print("Input directory not found:", IN)
-    sys.exit(1)
 
-pngs = sorted([p for p in IN.iterdir() if p.suffix.lower() in (".png", ".jpg", ".jpeg")])
-if not pngs:
-    print("No images found in", IN)
-    sys.exit(0)
 
-for p in pngs:
+def whiten(p: Path) -> None:
+    # Errors are reported per image so one bad file doesn't stop the others
     try:
-        im = Image.open(p).convert("RGBA")
-        bg = Image.new("RGBA", im.size, (255, 255, 255, 255))
-        bg.paste(im, (0, 0), im)
-        out = bg.convert("RGB")
+        im = Image.open(p)
+        if im.mode not in ("RGBA", "LA", "PA") and "transparency" not in im.info:
+            # Nothing to composite (e.g. JPEGs, opaque PNGs)
+            out = im.convert("RGB")
+        else:
+            out = flatten_on_white(im.convert("RGBA"))
         out_path = OUT / p.name
-        out.save(out_path, quality=95)
+        if out_path.suffix.lower() == ".png":
+            out.save(out_path, compress_level=PNG_COMPRESS_LEVEL, optimize=False)
+        else:
+            out.save(out_path, quality=95)
         print("Wrote", out_path)
     except Exception as e:
         print("Failed", p, e)
 
-print("Done. Processed", len(pngs), "files ->", OUT)
+
+def main():
+    OUT.mkdir(exist_ok=True)
+
+    if not IN.exists():
+        print("Input directory not found:", IN)
+        sys.exit(1)
+
+    pngs = sorted([p for p in IN.iterdir() if p.suffix.lower() in (".png", ".jpg", ".jpeg")])
+    if not pngs:
+        print("No images found in", IN)
+        sys.exit(0)
+
+    # Images are independent and CPU-bound, so spread them over all cores
+    with ProcessPoolExecutor() as ex:
+        list(ex.map(whiten, pngs, chunksize=4))
+
+    print("Done. Processed", len(pngs), "files ->", OUT)
+
+
+if __name__ == "__main__":
+    main()
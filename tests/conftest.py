@@ -0,0 +1,27 @@
+import importlib
+import os
+import sys
+from pathlib import Path
+
+import pytest
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+
+sys.path.insert(0, str(REPO_ROOT))
+sys.path.insert(0, str(REPO_ROOT / "scripts"))
+
+
+@pytest.fixture(scope="session")
+def pn(tmp_path_factory):
+    """
+    The scripts/process_notebook module, imported from an empty working directory:
+    on import it creates its output folders under the cwd and reads config.yml there.
+    """
+    workdir = tmp_path_factory.mktemp("pipeline")
+    old_cwd = os.getcwd()
+    os.chdir(workdir)
+    try:
+        module = importlib.import_module("process_notebook")
+    finally:
+        os.chdir(old_cwd)
+    return module
@@ -0,0 +1,233 @@
+import dataclasses
+import json
+
+import pytest
+
+from remarkable_mcp import clean
+
+
+@pytest.fixture
+def config(monkeypatch):
+    """Cleanup enabled with an API key, no rate limits, default batching and caching."""
+    monkeypatch.setenv("OPENAI_API_KEY", "sk-test")
+    cfg = dataclasses.replace(
+        clean._config(),
+        repair_model="test-model",
+        enable_repair=True,
+        enable_batch_api=False,
+        batch_size=8,
+        rpm=0,
+        tpm=0,
+        concurrency=2,
+        min_chars=1,
+        enable_cache=True,
+    )
+    monkeypatch.setattr(clean, "_config", lambda: cfg)
+    monkeypatch.setattr(clean, "_read_prompt_instructions", lambda: "Clean this OCR text.")
+    return cfg
+
+
+# --- _repair_batch ---
+
+
+def test_repair_batch_parses_items(config, monkeypatch):
+    monkeypatch.setattr(
+        clean,
+        "_openai_chat",
+        lambda prompt, json_mode=False: json.dumps({"items": [" one ", "two"]}),
+    )
+    assert clean._repair_batch(["1", "2"]) == ["one", "two"]
+
+
+def test_repair_batch_sends_items_as_json(config, monkeypatch):
+    prompts = []
+
+    def chat(prompt, json_mode=False):
+        prompts.append((prompt, json_mode))
+        return json.dumps({"items": ["a", "b"]})
+
+    monkeypatch.setattr(clean, "_openai_chat", chat)
+    clean._repair_batch(['say "hi"', "b"])
+
+    prompt, json_mode = prompts[0]
+    assert json_mode
+    items_json = prompt.split("ITEMS:\n", 1)[1]
+    assert json.loads(items_json) == {"items": ['say "hi"', "b"]}
+
+
+@pytest.mark.parametrize(
+    "response",
+    [
+        "",
+        "not json",
+        json.dumps({"pages": ["a", "b"]}),
+        json.dumps({"items": "a"}),
+        json.dumps({"items": ["only one"]}),
+        json.dumps({"items": ["a", None]}),
+        json.dumps(["a", "b"]),
+    ],
+)
+def test_repair_batch_rejects_unusable_responses(config, monkeypatch, response):
+    monkeypatch.setattr(clean, "_openai_chat", lambda prompt, json_mode=False: response)
+    assert clean._repair_batch(["1", "2"]) is None
+
+
+def test_unparsable_batch_falls_back_to_per_page_calls(config, monkeypatch, tmp_path):
+    monkeypatch.setattr(clean, "_repair_batch", lambda texts: None)
+    monkeypatch.setattr(clean, "repair_text_with_openai", lambda text: text.upper())
+
+    assert clean.repair_texts_with_openai(["page one", "page two"], cache_dir=tmp_path) == [
+        "PAGE ONE",
+        "PAGE TWO",
+    ]
+
+
+def test_empty_results_keep_the_original(config, monkeypatch, tmp_path):
+    monkeypatch.setattr(clean, "_repair_batch", lambda texts: ["", "cleaned"])
+
+    assert clean.repair_texts_with_openai(["raw one", "raw two"], cache_dir=tmp_path) == [
+        "raw one",
+        "cleaned",
+    ]
+
+
+# --- share_limits ---
+
+
+def test_share_limits_divides_limits(config, monkeypatch):
+    cfg = dataclasses.replace(config, rpm=60, tpm=0, concurrency=8)
+    monkeypatch.setattr(clean, "_config", lambda: cfg)
+    monkeypatch.setattr(clean, "_processes", 1)
+    monkeypatch.setattr(clean, "_request_bucket", clean._request_bucket)
+    monkeypatch.setattr(clean, "_token_bucket", clean._token_bucket)
+
+    clean.share_limits(3)
+
+    assert clean._request_bucket.capacity == 20
+    assert clean._token_bucket.rate == 0  # unlimited stays unlimited
+    assert clean._concurrency() == 2
+
+    clean.share_limits(16)
+    assert clean._concurrency() == 1
+
+
+# --- Near-blank pages ---
+
+
+def test_blank_pages_are_not_sent(config, monkeypatch, tmp_path):
+    sent = []
+
+    def repair_batch(texts):
+        sent.append(texts)
+        return [t.upper() for t in texts]
+
+    monkeypatch.setattr(clean, "_repair_batch", repair_batch)
+    monkeypatch.setattr(clean, "repair_text_with_openai", lambda text: text.upper())
+
+    assert clean.repair_texts_with_openai(["", "  \n", "text"], cache_dir=tmp_path) == [
+        "",
+        "  \n",
+        "TEXT",
+    ]
+    assert sent == []
+
+
+# --- Cleanup cache ---
+
+
+def test_cached_pages_skip_the_request(config, monkeypatch, tmp_path):
+    calls = []
+
+    def repair_batch(texts):
+        calls.append(list(texts))
+        return [t.upper() for t in texts]
+
+    monkeypatch.setattr(clean, "_repair_batch", repair_batch)
+
+    texts = ["page one", "page two"]
+    first = clean.repair_texts_with_openai(texts, cache_dir=tmp_path)
+    second = clean.repair_texts_with_openai(texts, cache_dir=tmp_path)
+
+    assert first == second == ["PAGE ONE", "PAGE TWO"]
+    assert calls == [texts]
+    assert len(list(tmp_path.rglob("*.txt"))) == 2
+
+
+def test_unchanged_pages_are_not_cached(config, monkeypatch, tmp_path):
+    # A failed call returns the page unchanged; caching it would never retry the page
+    monkeypatch.setattr(clean, "_repair_batch", lambda texts: list(texts))
+    clean.repair_texts_with_openai(["page one", "page two"], cache_dir=tmp_path)
+    assert list(tmp_path.rglob("*.txt")) == []
+
+
+def test_cache_disabled(config, monkeypatch, tmp_path):
+    monkeypatch.setattr(clean, "_config", lambda: dataclasses.replace(config, enable_cache=False))
+    monkeypatch.setattr(clean, "_repair_batch", lambda texts: [t.upper() for t in texts])
+    clean.repair_texts_with_openai(["page one", "page two"], cache_dir=tmp_path)
+    assert list(tmp_path.rglob("*.txt")) == []
+
+
+def test_cache_key_covers_text_model_and_prompt(config, monkeypatch, tmp_path):
+    key = clean._repair_cache_path("text", tmp_path)
+    assert key == clean._repair_cache_path("text", tmp_path)
+    assert key.parent.parent == tmp_path
+    assert key.parent.name == key.stem[:2]
+
+    assert clean._repair_cache_path("other text", tmp_path) != key
+
+    monkeypatch.setattr(clean, "_read_prompt_instructions", lambda: "New instructions.")
+    assert clean._repair_cache_path("text", tmp_path) != key
+
+    monkeypatch.setattr(
+        clean, "_config", lambda: dataclasses.replace(config, repair_model="other-model")
+    )
+    assert clean._repair_cache_path("text", tmp_path) != key
+
+
+# --- Batch API ---
+
+
+def test_batch_api_uses_the_per_page_prompt(config, monkeypatch, tmp_path):
+    monkeypatch.setattr(
+        clean, "_config", lambda: dataclasses.replace(config, enable_batch_api=True)
+    )
+    submitted = {}
+
+    def openai_batch(prompts):
+        submitted.update(prompts)
+        return {custom_id: "cleaned" for custom_id in prompts}
+
+    monkeypatch.setattr(clean, "_openai_batch", openai_batch)
+
+    texts = ["", "page two"]
+    assert clean.repair_texts_with_openai(texts, cache_dir=tmp_path) == ["", "cleaned"]
+    assert submitted == {"1": clean._repair_prompt("page two")}
+
+
+# --- Retries ---
+
+
+class _Response:
+    def __init__(self, retry_after):
+        self.headers = {} if retry_after is None else {"Retry-After": retry_after}
+
+
+@pytest.mark.parametrize(
+    "retry_after, expected",
+    [("5", 5.0), ("0", 0.0), ("86400", clean._MAX_BACKOFF), ("-3", 0.0)],
+)
+def test_retry_after_is_honoured_up_to_the_cap(retry_after, expected):
+    assert clean._retry_delay(0, _Response(retry_after)) == expected
+
+
+def test_retry_delay_backs_off_without_header():
+    assert 1.0 <= clean._retry_delay(0) < 2.0
+    assert clean._retry_delay(0, _Response("soon")) < 2.0
+    assert clean._MAX_BACKOFF <= clean._retry_delay(20) < clean._MAX_BACKOFF + 1
+
+
+def test_no_cache_dir_caches_nothing(config, monkeypatch, tmp_path):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(clean, "_repair_batch", lambda texts: [t.upper() for t in texts])
+    assert clean.repair_texts_with_openai(["page one", "page two"]) == ["PAGE ONE", "PAGE TWO"]
+    assert list(tmp_path.rglob("*")) == []
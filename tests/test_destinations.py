@@ -0,0 +1,43 @@
+import html
+
+import pytest
+
+from remarkable_mcp.destinations import AppleNotesDestination
+
+
+def _legacy_convert_to_html(text: str) -> str:
+    """The original line-by-line conversion, kept as the reference output."""
+    html_lines = []
+    for line in text.lstrip().splitlines():
+        if not line:
+            html_lines.append("<div><br></div>")
+        else:
+            html_lines.append(f"<div>{html.escape(line)}</div>")
+    return "".join(html_lines)
+
+
+@pytest.mark.parametrize(
+    "text",
+    [
+        "",
+        "\n\n  ",
+        "one line",
+        "one line\n",
+        "first\nsecond\n\nafter blank\n",
+        "  leading space\n--- Page 1 ---\ntext\n\n\n\n--- Page 2 ---\nmore\n\n",
+        "<b>tags</b> & \"quotes\" 'apostrophes'",
+        "windows\r\nline\r\n\r\nendings\r\n",
+        "old mac\rline\r",
+        "form\x0cfeed\x0bvertical\x1cfile\x1dgroup\x1erecord",
+        "next\x85line\u2028separator\u2029paragraph",
+        "trailing blanks\n\n\n",
+    ],
+)
+def test_convert_to_html_matches_line_by_line_version(text):
+    assert AppleNotesDestination()._convert_to_html(text) == _legacy_convert_to_html(text)
+
+
+def test_convert_to_html_escapes_and_marks_blank_lines():
+    assert AppleNotesDestination()._convert_to_html("a < b\n\nc") == (
+        "<div>a &lt; b</div><div><br></div><div>c</div>"
+    )
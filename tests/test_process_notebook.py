@@ -0,0 +1,280 @@
+import json
+import os
+
+import pytest
+
+
+# --- Cached page texts ---
+
+
+def test_read_cached_text_requires_newer_text(pn, tmp_path):
+    source = tmp_path / "page.jpg"
+    text = tmp_path / "page.txt"
+    source.write_bytes(b"image")
+    text.write_text("cached", encoding="utf-8")
+
+    os.utime(source, (1000, 1000))
+    os.utime(text, (2000, 2000))
+    assert pn.read_cached_text(text, source) == "cached"
+
+    os.utime(source, (3000, 3000))
+    assert pn.read_cached_text(text, source) is None
+    assert pn.read_cached_text(tmp_path / "missing.txt", source) is None
+
+
+# --- Saved OCR text ---
+
+
+def test_format_pages_marks_every_page(pn):
+    assert pn.format_pages(["a", None, " b "]) == (
+        "--- Page 1 ---\na\n\n--- Page 2 ---\n\n\n--- Page 3 ---\nb\n\n"
+    )
+
+
+# --- StateStore ---
+
+
+@pytest.fixture
+def state_root(pn, tmp_path, monkeypatch):
+    monkeypatch.setattr(pn, "ROOT", tmp_path)
+    return tmp_path
+
+
+def test_state_flush_and_reload(pn, state_root):
+    store = pn.StateStore()
+    store.set("ObsidianDestination", "doc1", "hash1")
+    store.set("ObsidianDestination", "doc2", 3)
+    store.flush()
+
+    path = state_root / "processed_notebooks_ObsidianDestination.json"
+    assert json.loads(path.read_text()) == {"doc1": "hash1", "doc2": 3}
+    # No temp files are left next to the log
+    assert [p.name for p in state_root.iterdir()] == [path.name]
+
+    reloaded = pn.StateStore()
+    assert reloaded.load("ObsidianDestination") == {"doc1": "hash1", "doc2": 3}
+
+
+# --- Published note text ---
+
+
+def _legacy_note_text(saved: str) -> str:
+    """How the published text used to be recovered from a saved *_clean.txt file."""
+    lines = saved.split("\n")
+    text_start = 0
+    for i, line in enumerate(lines):
+        if line.startswith("---"):
+            text_start = i
+            break
+    return "\n".join(lines[text_start:]).replace("--- Page", "\n\n--- Page").lstrip()
+
+
+@pytest.mark.parametrize(
+    "texts",
+    [
+        ["first page", "second page"],
+        ["  padded  \n", "", None, "multi\nline\n\ntext"],
+        ["only page"],
+    ],
+)
+def test_format_note_text_matches_saved_page_markers(pn, texts):
+    saved = json.dumps({"notebook": "N", "images": []}) + "\n\n" + pn.format_pages(texts)
+    assert pn.format_note_text(texts) == _legacy_note_text(saved)
+
+
+def test_format_note_text_empty(pn):
+    assert pn.format_note_text([]) == ""
+
+
+# --- StateStore writes and loads ---
+
+
+def test_state_flush_only_writes_changed_logs(pn, state_root):
+    store = pn.StateStore()
+    store.set("AppleNotesDestination", "doc1", "v1")
+    store.flush()
+    path = state_root / "processed_notebooks_AppleNotesDestination.json"
+    mtime = path.stat().st_mtime_ns
+
+    # Setting the same version again is not a change
+    store.set("AppleNotesDestination", "doc1", "v1")
+    store.flush()
+    assert path.stat().st_mtime_ns == mtime
+
+
+def test_state_failed_write_keeps_previous_log(pn, state_root, monkeypatch):
+    store = pn.StateStore()
+    store.set("ObsidianDestination", "doc1", "v1")
+    store.flush()
+    path = state_root / "processed_notebooks_ObsidianDestination.json"
+
+    def fail_replace(src, dst):
+        raise OSError("disk full")
+
+    store.set("ObsidianDestination", "doc1", "v2")
+    monkeypatch.setattr(pn.os, "replace", fail_replace)
+    with pytest.raises(OSError):
+        store.flush()
+
+    assert json.loads(path.read_text()) == {"doc1": "v1"}
+    assert [p.name for p in state_root.iterdir()] == [path.name]
+
+
+def test_state_loads_legacy_list_format(pn, state_root):
+    path = state_root / "processed_notebooks_ObsidianDestination.json"
+    path.write_text(json.dumps(["doc1", "doc2"]))
+    assert pn.StateStore().load("ObsidianDestination") == {"doc1": 0, "doc2": 0}
+
+
+def test_state_ignores_corrupt_log(pn, state_root):
+    path = state_root / "processed_notebooks_ObsidianDestination.json"
+    path.write_text("{not json")
+    assert pn.StateStore().load("ObsidianDestination") == {}
+
+
+# --- Page listing ---
+
+
+def test_scan_page_pngs_matches_exact_prefix(pn, tmp_path, monkeypatch):
+    monkeypatch.setattr(pn, "WHITE_DIR", tmp_path)
+    names = [
+        "Notebook_1.page-10.png",
+        "Notebook_1.page-2.png",
+        "Notebook_1.page-1.png",
+        "Notebook_10.page-1.png",
+        "Other.page-1.png",
+    ]
+    for name in names:
+        (tmp_path / name).touch()
+
+    assert [p.name for p in pn.scan_page_pngs("Notebook_1.")] == [
+        "Notebook_1.page-1.png",
+        "Notebook_1.page-2.png",
+        "Notebook_1.page-10.png",
+    ]
+    assert pn.scan_page_pngs("Missing.") == []
+
+
+# --- Page ordering ---
+
+
+def test_page_sort_key_orders_by_page_number(pn):
+    names = [
+        "Note.page-10.png",
+        "Note.page-2.png",
+        "Note.cover.png",
+        "Note.page-1.png",
+    ]
+    assert sorted(names, key=pn._page_sort_key) == [
+        "Note.page-1.png",
+        "Note.page-2.png",
+        "Note.page-10.png",
+        "Note.cover.png",
+    ]
+
+
+# --- OCR cache ---
+
+
+def test_page_hash_keys_on_content(pn, tmp_path):
+    a = tmp_path / "a.jpg"
+    b = tmp_path / "b.jpg"
+    c = tmp_path / "c.jpg"
+    a.write_bytes(b"page one")
+    b.write_bytes(b"page one")
+    c.write_bytes(b"page two")
+
+    assert pn.page_hash(a) == pn.page_hash(b)
+    assert pn.page_hash(a) != pn.page_hash(c)
+    assert len(pn.page_hash(a)) == 32
+
+
+def test_write_text_atomic(pn, tmp_path):
+    path = tmp_path / "cache.txt"
+    path.write_text("old", encoding="utf-8")
+    pn.write_text_atomic(path, "new")
+    assert path.read_text(encoding="utf-8") == "new"
+    assert [p.name for p in tmp_path.iterdir()] == ["cache.txt"]
+
+
+# --- Image preprocessing ---
+
+
+def test_vips_autocontrast_stretches_each_band_like_pil(pn):
+    pyvips = pytest.importorskip("pyvips")
+    from PIL import Image, ImageOps
+
+    # Bands with different ranges, plus a flat one that must stay as it is
+    size = (64, 64)
+    bands = [
+        Image.linear_gradient("L").resize(size).point(lambda v: 40 + v // 4),
+        Image.linear_gradient("L").rotate(90).resize(size).point(lambda v: 120 + v // 3),
+        Image.new("L", size, 77),
+    ]
+    rgb = Image.merge("RGB", bands)
+    expected = ImageOps.autocontrast(rgb, cutoff=2)
+
+    im = pyvips.Image.new_from_memory(rgb.tobytes(), size[0], size[1], 3, "uchar")
+    out = pn._vips_autocontrast(im)
+    got = Image.frombytes("RGB", size, out.write_to_memory())
+
+    for g, e in zip(got.split(), expected.split()):
+        assert max(abs(a - b) for a, b in zip(g.getdata(), e.getdata())) <= 3
+    assert set(got.getchannel(2).getdata()) == {77}
+
+
+def test_preprocess_settings_change_clears_vision_dir(pn, tmp_path, monkeypatch):
+    vision_dir = tmp_path / "vision"
+    vision_dir.mkdir()
+    monkeypatch.setattr(pn, "VISION_DIR", vision_dir)
+    page = vision_dir / "Notebook" / "page_1.jpg"
+    page.parent.mkdir()
+    page.write_bytes(b"jpeg")
+
+    # Pages preprocessed with unknown settings are discarded
+    pn.check_preprocess_settings()
+    assert not page.exists()
+
+    page.parent.mkdir()
+    page.write_bytes(b"jpeg")
+    pn.check_preprocess_settings()
+    assert page.exists()
+
+    monkeypatch.setattr(pn, "VISION_JPEG_QUALITY", pn.VISION_JPEG_QUALITY - 10)
+    pn.check_preprocess_settings()
+    assert not page.exists()
+    assert json.loads((vision_dir / ".settings.json").read_text())["jpeg_quality"] == (
+        pn.VISION_JPEG_QUALITY
+    )
+
+
+# --- Configuration ---
+
+
+def test_load_config_reads_config_yml(pn, tmp_path, monkeypatch):
+    config_yml = tmp_path / "config.yml"
+    config_yml.write_text(
+        "sync:\n  max_notebooks_per_run: 3\napple_notes:\n  folder_name: Inbox\n",
+        encoding="utf-8",
+    )
+    monkeypatch.setattr(pn, "YAML_CONFIG_PATH", config_yml)
+    monkeypatch.setattr(pn, "CONFIG_PATH", tmp_path / "config.py")
+    monkeypatch.setattr(pn, "ACTIVE_DESTINATIONS", [])
+    monkeypatch.setattr(pn, "max_notebooks_per_run", 1)
+    # load_config() exports config.yml settings; let monkeypatch restore them
+    monkeypatch.delenv("SYNC_MAX_NOTEBOOKS", raising=False)
+    monkeypatch.delenv("APPLE_NOTES_FOLDER", raising=False)
+
+    pn.load_config()
+
+    assert pn.max_notebooks_per_run == 3
+    assert [d.folder_name for d in pn.ACTIVE_DESTINATIONS] == ["Inbox"]
+
+
+def test_notebook_workers_share_vision_concurrency(pn, monkeypatch):
+    monkeypatch.setattr(pn, "share_limits", lambda processes: None)
+    monkeypatch.setattr(pn, "VISION_CONCURRENCY", 8)
+    pn.init_notebook_worker(3)
+    assert pn.VISION_CONCURRENCY == 2
+    pn.init_notebook_worker(16)
+    assert pn.VISION_CONCURRENCY == 1